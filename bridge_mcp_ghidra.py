@@ -1,231 +1,1098 @@
 # /// script
 # requires-python = ">=3.10"
 # dependencies = [
-#     "requests>=2,<3",
 #     "mcp>=1.2.0,<2",
+#     "httpx>=0.24,<1",
 # ]
 # ///
 
+import re
 import sys
-import requests
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import functools
+import inspect
+import contextvars
+import hashlib
+import sqlite3
+import gzip
+import atexit
 import argparse
 import logging
+import httpx
+from array import array
+from collections import OrderedDict, defaultdict, deque
+from pathlib import Path
 from urllib.parse import urljoin
 
 from mcp.server.fastmcp import FastMCP
 
 DEFAULT_GHIDRA_SERVER = "http://127.0.0.1:8080/"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 5.0
+
+# Endpoints that make Ghidra run the decompiler need far more than the default timeout
+ENDPOINT_TIMEOUTS = {
+    "decompile": 60.0,
+    "decompile_function": 60.0,
+    "disassemble_function": 30.0,
+}
+
+DEFAULT_CACHE_ENTRIES = 512
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# How long the program fingerprint is trusted before it is fetched again
+PROGRAM_KEY_TTL = 30.0
+# Lines of each listing (segments, imports, exports) hashed into the program fingerprint
+PROGRAM_KEY_LINES = 100
+
+DEFAULT_BULK_PARALLELISM = 4
+DEFAULT_BULK_CHUNK = 10000
+# Number of complete listings (per program/endpoint/arguments) kept in memory
+LISTING_CACHE_ENTRIES = 256
+
+# Paginated listing endpoints served by bulk_list, with the page size used to fetch them
+BULK_LISTINGS = {
+    "methods": 1000,
+    "classes": 1000,
+    "segments": 1000,
+    "imports": 1000,
+    "exports": 1000,
+    "namespaces": 1000,
+    "data": 1000,
+    "strings": 2000,
+}
+XREF_PAGE_SIZE = 1000
+
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# Latency samples kept per tool/endpoint for percentile estimates
+STATS_SAMPLES = 2048
+
+# Requests allowed to queue for a slot before new ones are rejected (0 = unbounded)
+DEFAULT_MAX_QUEUE = 256
+# Request priorities; lower runs first when the concurrency limit is reached
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Endpoints that change what the decompiler would return for some function
+MUTATING_ENDPOINTS = {
+    "renameFunction",
+    "renameData",
+    "renameVariable",
+    "rename_function_by_address",
+    "set_function_prototype",
+    "set_local_variable_type",
+    "set_decompiler_comment",
+    "set_disassembly_comment",
+}
 
 logger = logging.getLogger(__name__)
+# httpx logs every request at INFO, which floods the sse transport log
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 mcp = FastMCP("ghidra-mcp")
 
 # Initialize ghidra_server_url with default value
 ghidra_server_url = DEFAULT_GHIDRA_SERVER
 
-def safe_get(endpoint: str, params: dict = None) -> list:
+# Connection pool settings, overridable from the command line
+pool_size = DEFAULT_POOL_SIZE
+keepalive_expiry = DEFAULT_KEEPALIVE_EXPIRY
+default_timeout = DEFAULT_TIMEOUT
+
+# Shared client, created lazily so the settings above can be changed first
+_async_client = None
+
+# Set with --program-id to name the open program; required for persisting caches
+program_id = None
+_program_key = None
+_program_key_time = 0.0
+
+class DecompileCache:
+    """
+    LRU cache of decompiler output, bounded by entry count and total bytes.
+    If a database path is given, entries are also persisted there so a
+    restarted bridge starts warm.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped on every invalidation so in-flight decompiles started before a
+        # mutation don't store stale output afterwards
+        self.generation = 0
+        self.cache_dir = None
+        self.db = None
+        self.db_key = None
+        # Whether the on-disk store may hold entries, so repeated clears skip the write
+        self.db_dirty = False
+
+    def open(self, program_key: str):
+        """
+        Attach the on-disk store for the given program, loading its entries.
+        """
+        if self.cache_dir is None or self.db_key == program_key:
+            return
+        if self.db is not None:
+            self.db.close()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.cache_dir / f"decompile-{program_key}.sqlite")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT)")
+        self.db_key = program_key
+        self.db_dirty = True
+        rows = self.db.execute(
+            "SELECT key, value FROM entries ORDER BY rowid DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for key, value in reversed(rows):
+            self._insert(key, value)
+
+    def get(self, key: str) -> str | None:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: str):
+        self._insert(key, value)
+        if self.db is not None and key in self.entries:
+            self.db.execute("INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)", (key, value))
+            self.db.commit()
+            self.db_dirty = True
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+        self.generation += 1
+        self.invalidations += 1
+        if self.db is not None and self.db_dirty:
+            self.db.execute("DELETE FROM entries")
+            self.db.commit()
+            self.db_dirty = False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "persistent": self.db is not None,
+        }
+
+    def _insert(self, key: str, value: str):
+        nbytes = len(value.encode("utf-8"))
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key).encode("utf-8"))
+        self.entries[key] = value
+        self.size += nbytes
+        evicted = []
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.size -= len(old_value.encode("utf-8"))
+            evicted.append((old_key,))
+        if evicted and self.db is not None:
+            self.db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+decompile_cache = DecompileCache()
+
+class LatencyStats:
+    """
+    Call, error and byte counters plus a bounded sample of recent latencies
+    for one tool or endpoint.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=STATS_SAMPLES)
+
+    def record(self, seconds: float, nbytes: int = 0, error: bool = False):
+        self.count += 1
+        self.errors += error
+        self.bytes += nbytes
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+tool_stats = defaultdict(LatencyStats)
+endpoint_stats = defaultdict(LatencyStats)
+listing_cache_hits = 0
+listing_cache_misses = 0
+
+# Open gzip JSON Lines file that requests are recorded to (--record-trace)
+trace_file = None
+
+class PriorityLimiter:
+    """
+    Global cap on concurrent requests to the (single-threaded) Ghidra plugin.
+    Waiters are served by priority then arrival order; bulk requests may not
+    take the last slot, so interactive reads never wait behind a listing crawl.
+    When the queue is full new requests are rejected instead of piling up.
+    """
+
+    def __init__(self, limit: int = DEFAULT_POOL_SIZE, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiters = []
+        self.order = itertools.count()
+        self.rejected = 0
+        self.queue_peak = 0
+        self.wait_stats = LatencyStats()
+
+    def can_run(self, priority: int) -> bool:
+        if priority == PRIORITY_INTERACTIVE:
+            return self.active < self.limit
+        return self.active < max(self.limit - 1, 1)
+
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+    async def acquire(self, priority: int) -> bool:
+        """
+        Wait for a slot; returns False if the request was rejected.
+        """
+        while self.waiters and self.waiters[0][2].done():
+            heapq.heappop(self.waiters)
+        if self.can_run(priority) and (not self.waiters or self.waiters[0][0] > priority):
+            self.active += 1
+            self.wait_stats.record(0.0)
+            return True
+        queued = self.queued()
+        if self.max_queue and queued >= self.max_queue:
+            self.rejected += 1
+            return False
+        self.queue_peak = max(self.queue_peak, queued + 1)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.order), future))
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return True
+
+    def release(self):
+        self.active -= 1
+        while self.waiters and self.can_run(self.waiters[0][0]):
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def overload_message(self) -> str:
+        return f"Error 503: bridge overloaded, {self.queued()} requests already queued for Ghidra"
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued(),
+            "queue_peak": self.queue_peak,
+            "rejected": self.rejected,
+            "wait_p50_ms": round(self.wait_stats.percentile(0.5) * 1000, 1),
+            "wait_p95_ms": round(self.wait_stats.percentile(0.95) * 1000, 1),
+        }
+
+limiter = PriorityLimiter()
+request_priority = contextvars.ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+# In-flight [task, waiter count] by (method, endpoint, payload), shared by identical callers
+_inflight = {}
+coalesced_requests = 0
+
+def normalize_address(address: str) -> str:
+    address = address.strip().lower()
+    if address.startswith("0x"):
+        address = address[2:]
+    return address.lstrip("0") or "0"
+
+def trigrams(text: str) -> set:
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SymbolIndex:
+    """
+    In-memory trigram index over function, class, import and export names and
+    string contents, answering substring, regex and fuzzy queries locally.
+    """
+
+    KINDS = ("function", "class", "import", "export", "string")
+
+    def __init__(self, program_key: str | None = None):
+        self.program_key = program_key
+        # [kind, name, address] per entry; removed entries are set to None
+        self.entries = []
+        self.gram_counts = []
+        self.postings = defaultdict(set)
+        # Normalized address -> entry id of each function, for renames
+        self.functions = {}
+
+    def add(self, kind: str, name: str, address: str = ""):
+        entry_id = len(self.entries)
+        grams = trigrams(name)
+        self.entries.append([kind, name, address])
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].add(entry_id)
+        if kind == "function" and address:
+            self.functions[normalize_address(address)] = entry_id
+
+    def remove(self, entry_id: int):
+        kind, name, address = self.entries[entry_id]
+        for gram in trigrams(name):
+            self.postings[gram].discard(entry_id)
+        self.entries[entry_id] = None
+        if kind == "function" and address:
+            self.functions.pop(normalize_address(address), None)
+
+    def rename_function(self, new_name: str, old_name: str = None, address: str = None):
+        if address is not None:
+            entry_id = self.functions.get(normalize_address(address))
+        else:
+            entry_id = next((i for i, entry in enumerate(self.entries)
+                             if entry is not None and entry[0] == "function" and entry[1] == old_name), None)
+        if entry_id is not None:
+            address = self.entries[entry_id][2]
+            self.remove(entry_id)
+            self.add("function", new_name, address)
+
+    def _live(self, ids, kinds):
+        for entry_id in ids:
+            entry = self.entries[entry_id]
+            if entry is not None and (kinds is None or entry[0] in kinds):
+                yield entry_id, entry
+
+    def substring(self, query: str, kinds: set = None, limit: int = 100) -> list:
+        needle = query.lower()
+        grams = trigrams(needle)
+        if grams:
+            ids = set.intersection(*(self.postings.get(g, set()) for g in grams))
+            ids = sorted(ids)
+        else:
+            ids = range(len(self.entries))
+        results = []
+        for entry_id, entry in self._live(ids, kinds):
+            if needle in entry[1].lower():
+                results.append(entry)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def regex(self, pattern: str, kinds: set = None, limit: int = 100) -> list:
+        compiled = re.compile(pattern)
+        results = []
+        for entry_id, entry in self._live(range(len(self.entries)), kinds):
+            if compiled.search(entry[1]):
+                results.append(entry)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def fuzzy(self, query: str, kinds: set = None, limit: int = 100) -> list:
+        grams = trigrams(query)
+        if not grams:
+            return self.substring(query, kinds, limit)
+        shared = defaultdict(int)
+        for gram in grams:
+            for entry_id in self.postings.get(gram, ()):
+                shared[entry_id] += 1
+        scored = []
+        for entry_id, entry in self._live(shared, kinds):
+            count = shared[entry_id]
+            score = count / (len(grams) + self.gram_counts[entry_id] - count)
+            scored.append((-score, len(entry[1]), entry_id))
+        scored.sort()
+        return [self.entries[entry_id] for _, _, entry_id in scored[:limit]]
+
+    def stats(self) -> dict:
+        counts = defaultdict(int)
+        for entry in self.entries:
+            if entry is not None:
+                counts[entry[0]] += 1
+        return dict(counts)
+
+symbol_index = SymbolIndex()
+
+class CallGraph:
+    """
+    Function reference graph stored as CSR adjacency arrays in both
+    directions (callees and callers), persisted as a single snapshot file.
+    """
+
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, program_key: str, names: list, addresses: list,
+                 fwd_offsets: array, fwd_targets: array, rev_offsets: array, rev_targets: array):
+        self.program_key = program_key
+        self.names = names
+        self.addresses = addresses
+        self.fwd_offsets = fwd_offsets
+        self.fwd_targets = fwd_targets
+        self.rev_offsets = rev_offsets
+        self.rev_targets = rev_targets
+        self.by_name = {}
+        for node, name in enumerate(names):
+            self.by_name.setdefault(name, node)
+        self.by_address = {normalize_address(a): node for node, a in enumerate(addresses)}
+
+    @classmethod
+    def from_edges(cls, program_key: str, names: list, addresses: list, edges: set):
+        n = len(names)
+        fwd_offsets, fwd_targets = cls._csr(n, edges)
+        rev_offsets, rev_targets = cls._csr(n, [(dst, src) for src, dst in edges])
+        return cls(program_key, names, addresses, fwd_offsets, fwd_targets, rev_offsets, rev_targets)
+
+    @staticmethod
+    def _csr(n: int, edges) -> tuple:
+        edges = sorted(edges)
+        offsets = array("I", bytes(4 * (n + 1)))
+        targets = array("I", (dst for _, dst in edges))
+        for src, _ in edges:
+            offsets[src + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+        return offsets, targets
+
+    @classmethod
+    def load(cls, path: Path):
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != cls.SNAPSHOT_VERSION:
+                raise ValueError(f"unsupported snapshot version {header.get('version')}")
+            n, m = len(header["names"]), header["edges"]
+            arrays = []
+            for count in (n + 1, m, n + 1, m):
+                values = array("I")
+                values.fromfile(f, count)
+                arrays.append(values)
+        return cls(header["program_key"], header["names"], header["addresses"], *arrays)
+
+    def save(self, path: Path):
+        header = {
+            "version": self.SNAPSHOT_VERSION,
+            "program_key": self.program_key,
+            "names": self.names,
+            "addresses": self.addresses,
+            "edges": len(self.fwd_targets),
+        }
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            for values in (self.fwd_offsets, self.fwd_targets, self.rev_offsets, self.rev_targets):
+                values.tofile(f)
+        tmp.replace(path)
+
+    def resolve(self, function: str) -> int | None:
+        node = self.by_name.get(function)
+        if node is None:
+            node = self.by_address.get(normalize_address(function))
+        return node
+
+    def rename_function(self, new_name: str, old_name: str = None, address: str = None):
+        node = self.by_address.get(normalize_address(address)) if address is not None else self.by_name.get(old_name)
+        if node is None:
+            return
+        if self.by_name.get(self.names[node]) == node:
+            del self.by_name[self.names[node]]
+        self.names[node] = new_name
+        self.by_name.setdefault(new_name, node)
+
+    def neighbors(self, node: int, reverse: bool = False):
+        offsets, targets = (self.rev_offsets, self.rev_targets) if reverse else (self.fwd_offsets, self.fwd_targets)
+        return targets[offsets[node]:offsets[node + 1]]
+
+    def reachable(self, node: int, reverse: bool = False, max_depth: int = 0) -> list:
+        """
+        Breadth-first walk from node, returning (node, depth) pairs excluding the start.
+        """
+        seen = {node}
+        frontier = [node]
+        result = []
+        depth = 0
+        while frontier and (max_depth <= 0 or depth < max_depth):
+            depth += 1
+            next_frontier = []
+            for current in frontier:
+                for neighbor in self.neighbors(current, reverse):
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        next_frontier.append(neighbor)
+                        result.append((neighbor, depth))
+            frontier = next_frontier
+        return result
+
+    def shortest_path(self, source: int, target: int) -> list | None:
+        parents = {source: None}
+        frontier = [source]
+        while frontier and target not in parents:
+            next_frontier = []
+            for current in frontier:
+                for neighbor in self.neighbors(current):
+                    if neighbor not in parents:
+                        parents[neighbor] = current
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        if target not in parents:
+            return None
+        path = [target]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        return path[::-1]
+
+    def sccs(self) -> list:
+        """
+        Strongly connected components (iterative Tarjan).
+        """
+        n = len(self.names)
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack = []
+        components = []
+        counter = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, self.fwd_offsets[root])]
+            while work:
+                node, edge = work[-1]
+                if edge < self.fwd_offsets[node + 1]:
+                    work[-1] = (node, edge + 1)
+                    neighbor = self.fwd_targets[edge]
+                    if index[neighbor] == -1:
+                        index[neighbor] = low[neighbor] = counter
+                        counter += 1
+                        stack.append(neighbor)
+                        on_stack[neighbor] = True
+                        work.append((neighbor, self.fwd_offsets[neighbor]))
+                    elif on_stack[neighbor]:
+                        low[node] = min(low[node], index[neighbor])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components
+
+call_graph = None
+
+# Number of listing pages fetched concurrently by bulk tools
+bulk_parallelism = DEFAULT_BULK_PARALLELISM
+_listing_cache = OrderedDict()
+
+def get_timeout(endpoint: str) -> float:
+    """
+    Return the request timeout (seconds) for an endpoint.
+    """
+    return ENDPOINT_TIMEOUTS.get(endpoint, default_timeout)
+
+def get_async_client() -> httpx.AsyncClient:
     """
-    Perform a GET request with optional query parameters.
+    Return the shared connection-pooled client used by the MCP tools.
+    """
+    global _async_client
+    if _async_client is None:
+        limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        _async_client = httpx.AsyncClient(limits=limits)
+    return _async_client
+
+def record_request(endpoint: str, start: float, response=None, method: str = "GET", payload=None):
+    """
+    Record one request to the Ghidra server; a missing response counts as an error.
+    With --record-trace, completed requests are also appended to the trace.
+    """
+    elapsed = time.perf_counter() - start
+    if response is None:
+        endpoint_stats[endpoint].record(elapsed, error=True)
+        return
+    endpoint_stats[endpoint].record(elapsed, len(response.content), response.status_code >= 400)
+    if trace_file is not None:
+        if isinstance(payload, dict):
+            payload = {k: str(v) for k, v in payload.items()}
+        trace_file.write(json.dumps({
+            "m": method, "e": endpoint, "p": payload, "s": response.status_code,
+            "b": response.content.decode("utf-8", "replace"), "t": round(elapsed, 6),
+        }, ensure_ascii=False) + "\n")
+
+def get_lines(status_code: int, text: str) -> list:
+    if status_code < 400:
+        return text.splitlines()
+    return [f"Error {status_code}: {text.strip()}"]
+
+def get_text(status_code: int, text: str) -> str:
+    if status_code < 400:
+        return text.strip()
+    return f"Error {status_code}: {text.strip()}"
+
+def request_key(method: str, endpoint: str, payload) -> tuple:
+    if isinstance(payload, dict):
+        payload = tuple(sorted((k, str(v)) for k, v in payload.items()))
+    return method, endpoint, payload
+
+async def coalesce(key: tuple, fetch):
+    """
+    Run fetch() once for all concurrent callers asking for the same request.
+    The shared request is cancelled only when every caller has given up.
+    """
+    global coalesced_requests
+    entry = _inflight.get(key)
+    if entry is None:
+        entry = [asyncio.ensure_future(fetch()), 0]
+        _inflight[key] = entry
+        entry[0].add_done_callback(lambda _: _inflight.pop(key, None) if _inflight.get(key) is entry else None)
+    else:
+        coalesced_requests += 1
+    task = entry[0]
+    entry[1] += 1
+    try:
+        # Shielded so one caller giving up doesn't cancel the request for the others
+        return await asyncio.shield(task)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and not task.done():
+            if _inflight.get(key) is entry:
+                del _inflight[key]
+            task.cancel()
+
+async def async_safe_get(endpoint: str, params: dict = None) -> list:
+    """
+    Perform a GET request over the shared async client.
+    Identical GETs already in flight are shared rather than sent again.
     """
     if params is None:
         params = {}
+    lines = await coalesce(request_key("GET", endpoint, params), lambda: limited_get(endpoint, params))
+    return list(lines)
 
+async def limited_get(endpoint: str, params: dict) -> list:
     url = urljoin(ghidra_server_url, endpoint)
 
+    if not await limiter.acquire(request_priority.get()):
+        return [limiter.overload_message()]
+    start = time.perf_counter()
     try:
-        response = requests.get(url, params=params, timeout=5)
+        response = await get_async_client().get(url, params=params, timeout=get_timeout(endpoint))
+        record_request(endpoint, start, response, "GET", params)
         response.encoding = 'utf-8'
-        if response.ok:
-            return response.text.splitlines()
-        else:
-            return [f"Error {response.status_code}: {response.text.strip()}"]
+        return get_lines(response.status_code, response.text)
     except Exception as e:
+        record_request(endpoint, start)
         return [f"Request failed: {str(e)}"]
+    finally:
+        limiter.release()
+
+async def async_safe_post(endpoint: str, data: dict | str) -> str:
+    """
+    Perform a POST request over the shared async client.
+    Identical read-only POSTs (decompile) already in flight are shared.
+    """
+    if endpoint in MUTATING_ENDPOINTS:
+        return await limited_post(endpoint, data)
+    return await coalesce(request_key("POST", endpoint, data), lambda: limited_post(endpoint, data))
 
-def safe_post(endpoint: str, data: dict | str) -> str:
+async def limited_post(endpoint: str, data: dict | str) -> str:
+    result = None
     try:
-        url = urljoin(ghidra_server_url, endpoint)
-        if isinstance(data, dict):
-            response = requests.post(url, data=data, timeout=5)
-        else:
-            response = requests.post(url, data=data.encode("utf-8"), timeout=5)
-        response.encoding = 'utf-8'
-        if response.ok:
-            return response.text.strip()
-        else:
-            return f"Error {response.status_code}: {response.text.strip()}"
-    except Exception as e:
-        return f"Request failed: {str(e)}"
+        if not await limiter.acquire(request_priority.get()):
+            result = limiter.overload_message()
+            return result
+        start = time.perf_counter()
+        try:
+            url = urljoin(ghidra_server_url, endpoint)
+            if isinstance(data, dict):
+                response = await get_async_client().post(url, data=data, timeout=get_timeout(endpoint))
+            else:
+                response = await get_async_client().post(url, content=data.encode("utf-8"), timeout=get_timeout(endpoint))
+            record_request(endpoint, start, response, "POST", data)
+            response.encoding = 'utf-8'
+            result = get_text(response.status_code, response.text)
+        except Exception as e:
+            record_request(endpoint, start)
+            result = f"Request failed: {str(e)}"
+        finally:
+            limiter.release()
+    finally:
+        # Invalidate once the edit has landed (or may have), so anything
+        # decompiled concurrently with it is discarded too
+        if endpoint in MUTATING_ENDPOINTS:
+            after_mutation(endpoint, data, result)
+    return result
+
+def after_mutation(endpoint: str, data: dict | str, result: str | None):
+    """
+    Drop cached state made stale by a mutating request.
+    A rename or type change can alter the output of any caller, so the whole
+    decompile cache is invalidated rather than just the edited function.
+    Function renames that succeeded are applied to the symbol index and call
+    graph in place.
+    """
+    decompile_cache.clear()
+    _listing_cache.clear()
+    if result is None or "success" not in result.lower():
+        return
+    for target in (symbol_index, call_graph):
+        if target is None:
+            continue
+        if endpoint == "renameFunction":
+            target.rename_function(data["newName"], old_name=data["oldName"])
+        elif endpoint == "rename_function_by_address":
+            target.rename_function(data["new_name"], address=data["function_address"])
+
+async def get_program_key(refresh: bool = False) -> str | None:
+    """
+    Return a key for the program currently open in Ghidra, or None if it
+    can't be fetched right now.
+    The plugin exposes no program name, path or hash, so this is a fingerprint
+    of the first lines of its segments, imports and exports (none of which the
+    bridge can mutate), fetched at most once per PROGRAM_KEY_TTL unless refresh
+    is set. It can collide: two builds of the same binary usually have the same
+    segments, imports and exports, and so the same key. A switch to another
+    program also goes unnoticed until the key is fetched again. With
+    --program-id the key is prefixed by that id.
+    """
+    global _program_key, _program_key_time
+    now = time.monotonic()
+    if not refresh and _program_key is not None and now - _program_key_time < PROGRAM_KEY_TTL:
+        return _program_key
+    listings = await asyncio.gather(*(
+        async_safe_get(endpoint, {"offset": 0, "limit": PROGRAM_KEY_LINES})
+        for endpoint in ("segments", "imports", "exports")
+    ))
+    digest = hashlib.sha256()
+    for lines in listings:
+        if is_error(lines):
+            return None
+        digest.update("\n".join(lines).encode("utf-8"))
+        digest.update(b"\0")
+    fingerprint = digest.hexdigest()[:16]
+    _program_key = f"{program_id}-{fingerprint}" if program_id else fingerprint
+    _program_key_time = now
+    return _program_key
+
+async def cached_decompile(kind: str, target: str, fetch) -> str:
+    """
+    Serve decompiler output from the cache, calling fetch() on a miss.
+    """
+    program_key = await get_program_key()
+    if program_key is None:
+        return await fetch()
+    decompile_cache.open(program_key)
+    key = f"{program_key}:{kind}:{target}"
+    cached = decompile_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = decompile_cache.generation
+    result = await fetch()
+    if generation == decompile_cache.generation and not result.startswith(("Error ", "Request failed")):
+        decompile_cache.put(key, result)
+    return result
+
+def is_error(lines: list) -> bool:
+    return bool(lines) and lines[0].startswith(("Error ", "Request failed"))
+
+async def fetch_all_pages(endpoint: str, params: dict = None, page_size: int = 1000) -> list:
+    """
+    Fetch every page of a paginated listing, keeping up to bulk_parallelism
+    page requests in flight. The listing ends at the first short page; the
+    first page is fetched alone so short listings cost a single request.
+    """
+    params = params or {}
+    pending = deque()
+    next_offset = 0
+    lines = []
+    # Page requests (and the tasks prefetching them) yield to interactive calls
+    priority = request_priority.set(PRIORITY_BULK)
+
+    def prefetch():
+        nonlocal next_offset
+        page_params = {**params, "offset": next_offset, "limit": page_size}
+        pending.append(asyncio.ensure_future(async_safe_get(endpoint, page_params)))
+        next_offset += page_size
+
+    try:
+        prefetch()
+        while True:
+            page = await pending.popleft()
+            if is_error(page):
+                return page
+            lines.extend(page)
+            if len(page) < page_size:
+                return lines
+            while len(pending) < max(bulk_parallelism, 1):
+                prefetch()
+    finally:
+        request_priority.reset(priority)
+        for task in pending:
+            task.cancel()
+
+async def get_listing(endpoint: str, params: dict = None, page_size: int = 1000, refresh: bool = False) -> list:
+    """
+    Return a complete listing, served from the per-program listing cache when possible.
+    """
+    params = params or {}
+    program_key = await get_program_key()
+    key = (program_key, endpoint, tuple(sorted(params.items())))
+    global listing_cache_hits, listing_cache_misses
+    if program_key is not None and not refresh and key in _listing_cache:
+        _listing_cache.move_to_end(key)
+        listing_cache_hits += 1
+        return _listing_cache[key]
+    listing_cache_misses += 1
+    lines = await fetch_all_pages(endpoint, params, page_size)
+    if program_key is not None and not is_error(lines):
+        _listing_cache[key] = lines
+        while len(_listing_cache) > LISTING_CACHE_ENTRIES:
+            _listing_cache.popitem(last=False)
+    return lines
+
+def failed_result(result) -> bool:
+    if isinstance(result, str):
+        return result.startswith(("Error", "Request failed"))
+    return isinstance(result, list) and is_error(result)
+
+def result_size(result) -> int:
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    if isinstance(result, list):
+        return sum(len(str(line).encode("utf-8")) + 1 for line in result)
+    return 0
+
+def tool():
+    """
+    Register an MCP tool, recording its latency, failures and result size in tool_stats.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            nbytes = 0
+            try:
+                result = await fn(*args, **kwargs)
+                error = failed_result(result)
+                nbytes = result_size(result)
+                return result
+            finally:
+                tool_stats[fn.__name__].record(time.perf_counter() - start, nbytes, error)
+        mcp.tool()(wrapper)
+        return wrapper
+    return decorator
 
-@mcp.tool()
-def list_methods(offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def list_methods(offset: int = 0, limit: int = 100) -> list:
     """
     List all function names in the program with pagination.
     """
-    return safe_get("methods", {"offset": offset, "limit": limit})
+    return await async_safe_get("methods", {"offset": offset, "limit": limit})
 
-@mcp.tool()
-def list_classes(offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def list_classes(offset: int = 0, limit: int = 100) -> list:
     """
     List all namespace/class names in the program with pagination.
     """
-    return safe_get("classes", {"offset": offset, "limit": limit})
+    return await async_safe_get("classes", {"offset": offset, "limit": limit})
 
-@mcp.tool()
-def decompile_function(name: str) -> str:
+@tool()
+async def decompile_function(name: str) -> str:
     """
     Decompile a specific function by name and return the decompiled C code.
     """
-    return safe_post("decompile", name)
+    return await cached_decompile("name", name, lambda: async_safe_post("decompile", name))
 
-@mcp.tool()
-def rename_function(old_name: str, new_name: str) -> str:
+@tool()
+async def rename_function(old_name: str, new_name: str) -> str:
     """
     Rename a function by its current name to a new user-defined name.
     """
-    return safe_post("renameFunction", {"oldName": old_name, "newName": new_name})
+    return await async_safe_post("renameFunction", {"oldName": old_name, "newName": new_name})
 
-@mcp.tool()
-def rename_data(address: str, new_name: str) -> str:
+@tool()
+async def rename_data(address: str, new_name: str) -> str:
     """
     Rename a data label at the specified address.
     """
-    return safe_post("renameData", {"address": address, "newName": new_name})
+    return await async_safe_post("renameData", {"address": address, "newName": new_name})
 
-@mcp.tool()
-def list_segments(offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def list_segments(offset: int = 0, limit: int = 100) -> list:
     """
     List all memory segments in the program with pagination.
     """
-    return safe_get("segments", {"offset": offset, "limit": limit})
+    return await async_safe_get("segments", {"offset": offset, "limit": limit})
 
-@mcp.tool()
-def list_imports(offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def list_imports(offset: int = 0, limit: int = 100) -> list:
     """
     List imported symbols in the program with pagination.
     """
-    return safe_get("imports", {"offset": offset, "limit": limit})
+    return await async_safe_get("imports", {"offset": offset, "limit": limit})
 
-@mcp.tool()
-def list_exports(offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def list_exports(offset: int = 0, limit: int = 100) -> list:
     """
     List exported functions/symbols with pagination.
     """
-    return safe_get("exports", {"offset": offset, "limit": limit})
+    return await async_safe_get("exports", {"offset": offset, "limit": limit})
 
-@mcp.tool()
-def list_namespaces(offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def list_namespaces(offset: int = 0, limit: int = 100) -> list:
     """
     List all non-global namespaces in the program with pagination.
     """
-    return safe_get("namespaces", {"offset": offset, "limit": limit})
+    return await async_safe_get("namespaces", {"offset": offset, "limit": limit})
 
-@mcp.tool()
-def list_data_items(offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def list_data_items(offset: int = 0, limit: int = 100) -> list:
     """
     List defined data labels and their values with pagination.
     """
-    return safe_get("data", {"offset": offset, "limit": limit})
+    return await async_safe_get("data", {"offset": offset, "limit": limit})
 
-@mcp.tool()
-def search_functions_by_name(query: str, offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def search_functions_by_name(query: str, offset: int = 0, limit: int = 100) -> list:
     """
     Search for functions whose name contains the given substring.
     """
     if not query:
         return ["Error: query string is required"]
-    return safe_get("searchFunctions", {"query": query, "offset": offset, "limit": limit})
+    return await async_safe_get("searchFunctions", {"query": query, "offset": offset, "limit": limit})
 
-@mcp.tool()
-def rename_variable(function_name: str, old_name: str, new_name: str) -> str:
+@tool()
+async def rename_variable(function_name: str, old_name: str, new_name: str) -> str:
     """
     Rename a local variable within a function.
     """
-    return safe_post("renameVariable", {
+    return await async_safe_post("renameVariable", {
         "functionName": function_name,
         "oldName": old_name,
         "newName": new_name
     })
 
-@mcp.tool()
-def get_function_by_address(address: str) -> str:
+@tool()
+async def get_function_by_address(address: str) -> str:
     """
     Get a function by its address.
     """
-    return "\n".join(safe_get("get_function_by_address", {"address": address}))
+    return "\n".join(await async_safe_get("get_function_by_address", {"address": address}))
 
-@mcp.tool()
-def get_current_address() -> str:
+@tool()
+async def get_current_address() -> str:
     """
     Get the address currently selected by the user.
     """
-    return "\n".join(safe_get("get_current_address"))
+    return "\n".join(await async_safe_get("get_current_address"))
 
-@mcp.tool()
-def get_current_function() -> str:
+@tool()
+async def get_current_function() -> str:
     """
     Get the function currently selected by the user.
     """
-    return "\n".join(safe_get("get_current_function"))
+    return "\n".join(await async_safe_get("get_current_function"))
 
-@mcp.tool()
-def list_functions() -> list:
+@tool()
+async def list_functions() -> list:
     """
     List all functions in the database.
     """
-    return safe_get("list_functions")
+    return await async_safe_get("list_functions")
 
-@mcp.tool()
-def decompile_function_by_address(address: str) -> str:
+@tool()
+async def decompile_function_by_address(address: str) -> str:
     """
     Decompile a function at the given address.
     """
-    return "\n".join(safe_get("decompile_function", {"address": address}))
+    async def fetch():
+        return "\n".join(await async_safe_get("decompile_function", {"address": address}))
+    return await cached_decompile("address", normalize_address(address), fetch)
 
-@mcp.tool()
-def disassemble_function(address: str) -> list:
+@tool()
+async def disassemble_function(address: str) -> list:
     """
     Get assembly code (address: instruction; comment) for a function.
     """
-    return safe_get("disassemble_function", {"address": address})
+    return await async_safe_get("disassemble_function", {"address": address})
 
-@mcp.tool()
-def set_decompiler_comment(address: str, comment: str) -> str:
+@tool()
+async def set_decompiler_comment(address: str, comment: str) -> str:
     """
     Set a comment for a given address in the function pseudocode.
     """
-    return safe_post("set_decompiler_comment", {"address": address, "comment": comment})
+    return await async_safe_post("set_decompiler_comment", {"address": address, "comment": comment})
 
-@mcp.tool()
-def set_disassembly_comment(address: str, comment: str) -> str:
+@tool()
+async def set_disassembly_comment(address: str, comment: str) -> str:
     """
     Set a comment for a given address in the function disassembly.
     """
-    return safe_post("set_disassembly_comment", {"address": address, "comment": comment})
+    return await async_safe_post("set_disassembly_comment", {"address": address, "comment": comment})
 
-@mcp.tool()
-def rename_function_by_address(function_address: str, new_name: str) -> str:
+@tool()
+async def rename_function_by_address(function_address: str, new_name: str) -> str:
     """
     Rename a function by its address.
     """
-    return safe_post("rename_function_by_address", {"function_address": function_address, "new_name": new_name})
+    return await async_safe_post("rename_function_by_address", {"function_address": function_address, "new_name": new_name})
 
-@mcp.tool()
-def set_function_prototype(function_address: str, prototype: str) -> str:
+@tool()
+async def set_function_prototype(function_address: str, prototype: str) -> str:
     """
     Set a function's prototype.
     """
-    return safe_post("set_function_prototype", {"function_address": function_address, "prototype": prototype})
+    return await async_safe_post("set_function_prototype", {"function_address": function_address, "prototype": prototype})
 
-@mcp.tool()
-def set_local_variable_type(function_address: str, variable_name: str, new_type: str) -> str:
+@tool()
+async def set_local_variable_type(function_address: str, variable_name: str, new_type: str) -> str:
     """
     Set a local variable's type.
     """
-    return safe_post("set_local_variable_type", {"function_address": function_address, "variable_name": variable_name, "new_type": new_type})
+    return await async_safe_post("set_local_variable_type", {"function_address": function_address, "variable_name": variable_name, "new_type": new_type})
 
-@mcp.tool()
-def get_xrefs_to(address: str, offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def get_xrefs_to(address: str, offset: int = 0, limit: int = 100) -> list:
     """
     Get all references to the specified address (xref to).
     
@@ -237,10 +1104,10 @@ def get_xrefs_to(address: str, offset: int = 0, limit: int = 100) -> list:
     Returns:
         List of references to the specified address
     """
-    return safe_get("xrefs_to", {"address": address, "offset": offset, "limit": limit})
+    return await async_safe_get("xrefs_to", {"address": address, "offset": offset, "limit": limit})
 
-@mcp.tool()
-def get_xrefs_from(address: str, offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def get_xrefs_from(address: str, offset: int = 0, limit: int = 100) -> list:
     """
     Get all references from the specified address (xref from).
     
@@ -252,10 +1119,10 @@ def get_xrefs_from(address: str, offset: int = 0, limit: int = 100) -> list:
     Returns:
         List of references from the specified address
     """
-    return safe_get("xrefs_from", {"address": address, "offset": offset, "limit": limit})
+    return await async_safe_get("xrefs_from", {"address": address, "offset": offset, "limit": limit})
 
-@mcp.tool()
-def get_function_xrefs(name: str, offset: int = 0, limit: int = 100) -> list:
+@tool()
+async def get_function_xrefs(name: str, offset: int = 0, limit: int = 100) -> list:
     """
     Get all references to the specified function by name.
     
@@ -267,10 +1134,10 @@ def get_function_xrefs(name: str, offset: int = 0, limit: int = 100) -> list:
     Returns:
         List of references to the specified function
     """
-    return safe_get("function_xrefs", {"name": name, "offset": offset, "limit": limit})
+    return await async_safe_get("function_xrefs", {"name": name, "offset": offset, "limit": limit})
 
-@mcp.tool()
-def list_strings(offset: int = 0, limit: int = 2000, filter: str = None) -> list:
+@tool()
+async def list_strings(offset: int = 0, limit: int = 2000, filter: str = None) -> list:
     """
     List all defined strings in the program with their addresses.
     
@@ -285,7 +1152,502 @@ def list_strings(offset: int = 0, limit: int = 2000, filter: str = None) -> list
     params = {"offset": offset, "limit": limit}
     if filter:
         params["filter"] = filter
-    return safe_get("strings", params)
+    return await async_safe_get("strings", params)
+
+@tool()
+async def bulk_list(kind: str, chunk: int = 0, chunk_size: int = DEFAULT_BULK_CHUNK, refresh: bool = False) -> list:
+    """
+    Fetch a complete listing in one call instead of paging through it with offset/limit.
+    The full listing is cached per program, so later chunks and repeated calls are served locally.
+    
+    Args:
+        kind: One of methods, classes, segments, imports, exports, namespaces, data, strings
+        chunk: Index of the chunk to return (default: 0)
+        chunk_size: Number of entries per chunk (default: 10000)
+        refresh: Refetch the listing from Ghidra instead of using the cache (default: False)
+        
+    Returns:
+        The requested chunk of the listing; if more chunks remain, the last line
+        is a "[chunk i/n, total entries]" marker
+    """
+    if kind not in BULK_LISTINGS:
+        return [f"Error: unknown kind {kind!r}, expected one of {', '.join(BULK_LISTINGS)}"]
+    if chunk_size <= 0:
+        return ["Error: chunk_size must be positive"]
+    lines = await get_listing(kind, page_size=BULK_LISTINGS[kind], refresh=refresh)
+    if is_error(lines):
+        return lines
+    chunks = max((len(lines) + chunk_size - 1) // chunk_size, 1)
+    if not 0 <= chunk < chunks:
+        return [f"Error: chunk {chunk} out of range, listing has {chunks} chunks"]
+    result = lines[chunk * chunk_size:(chunk + 1) * chunk_size]
+    if chunks > 1:
+        result = result + [f"[chunk {chunk + 1}/{chunks}, {len(lines)} total entries]"]
+    return result
+
+@tool()
+async def get_all_xrefs_to(address: str) -> list:
+    """
+    Get every reference to the specified address, fetching all pages at once.
+    
+    Args:
+        address: Target address in hex format (e.g. "0x1400010a0")
+        
+    Returns:
+        List of all references to the specified address
+    """
+    return await get_listing("xrefs_to", {"address": address}, XREF_PAGE_SIZE)
+
+@tool()
+async def get_all_xrefs_from(address: str) -> list:
+    """
+    Get every reference from the specified address, fetching all pages at once.
+    
+    Args:
+        address: Source address in hex format (e.g. "0x1400010a0")
+        
+    Returns:
+        List of all references from the specified address
+    """
+    return await get_listing("xrefs_from", {"address": address}, XREF_PAGE_SIZE)
+
+@tool()
+async def get_all_function_xrefs(name: str) -> list:
+    """
+    Get every reference to the specified function, fetching all pages at once.
+    
+    Args:
+        name: Function name to search for
+        
+    Returns:
+        List of all references to the specified function
+    """
+    return await get_listing("function_xrefs", {"name": name}, XREF_PAGE_SIZE)
+
+def parse_symbol_line(kind: str, line: str) -> tuple:
+    """
+    Split a listing line into (name, address) according to the plugin's format for that kind.
+    """
+    if kind == "function" and " at " in line:
+        name, address = line.rsplit(" at ", 1)
+    elif kind in ("import", "export") and " -> " in line:
+        name, address = line.split(" -> ", 1)
+    elif kind == "string" and ": " in line:
+        address, name = line.split(": ", 1)
+        if len(name) >= 2 and name[0] == name[-1] == '"':
+            name = name[1:-1]
+    else:
+        name, address = line, ""
+    return name.strip(), address.strip()
+
+async def build_symbol_index() -> str | None:
+    """
+    Rebuild the symbol index from full listings of the open program.
+    Returns an error message on failure.
+    """
+    global symbol_index
+    program_key = await get_program_key(refresh=True)
+    if program_key is None:
+        return "Error: could not identify the open program"
+    listings = await asyncio.gather(
+        async_safe_get("list_functions"),
+        get_listing("classes", page_size=BULK_LISTINGS["classes"]),
+        get_listing("imports", page_size=BULK_LISTINGS["imports"]),
+        get_listing("exports", page_size=BULK_LISTINGS["exports"]),
+        get_listing("strings", page_size=BULK_LISTINGS["strings"]),
+    )
+    for lines in listings:
+        if is_error(lines):
+            return lines[0]
+
+    def build():
+        index = SymbolIndex(program_key)
+        for kind, lines in zip(SymbolIndex.KINDS, listings):
+            for line in lines:
+                if line.strip():
+                    index.add(kind, *parse_symbol_line(kind, line))
+        return index
+
+    # Indexing a large program takes a while; keep the event loop responsive
+    symbol_index = await asyncio.to_thread(build)
+    return None
+
+@tool()
+async def search_symbols(query: str, mode: str = "substring", kinds: str = None,
+                         limit: int = 100, rebuild: bool = False) -> list:
+    """
+    Search function, class, import and export names and string contents
+    using a local index instead of asking Ghidra. The index is built on first
+    use per program and kept up to date with renames made through this bridge.
+    
+    Args:
+        query: Text to search for (a Python regular expression for mode="regex")
+        mode: "substring" (case-insensitive), "regex" or "fuzzy" (ranked by trigram similarity)
+        kinds: Optional comma-separated subset of function, class, import, export, string
+        limit: Maximum number of results to return (default: 100)
+        rebuild: Rebuild the index from Ghidra before searching (default: False)
+        
+    Returns:
+        List of matches formatted as "kind: name @ address"
+    """
+    if not query:
+        return ["Error: query string is required"]
+    kind_set = None
+    if kinds:
+        kind_set = {k.strip() for k in kinds.split(",") if k.strip()}
+        unknown = kind_set - set(SymbolIndex.KINDS)
+        if unknown:
+            return [f"Error: unknown kinds {', '.join(sorted(unknown))}"]
+    # Without a key (e.g. Ghidra overloaded) keep serving the existing index rather than rebuilding it
+    program_key = await get_program_key()
+    if rebuild or symbol_index.program_key is None or (program_key is not None and symbol_index.program_key != program_key):
+        error = await build_symbol_index()
+        if error:
+            return [error]
+
+    if mode == "substring":
+        matches = symbol_index.substring(query, kind_set, limit)
+    elif mode == "regex":
+        try:
+            matches = symbol_index.regex(query, kind_set, limit)
+        except re.error as e:
+            return [f"Error: invalid regex: {e}"]
+    elif mode == "fuzzy":
+        matches = symbol_index.fuzzy(query, kind_set, limit)
+    else:
+        return [f"Error: unknown mode {mode!r}, expected substring, regex or fuzzy"]
+    return [f"{kind}: {name} @ {address}" if address else f"{kind}: {name}" for kind, name, address in matches]
+
+XREF_LINE = re.compile(r"^From (\S+)(?: in (.+?))? \[(.+)\]$")
+
+def call_graph_path(program_key: str) -> Path | None:
+    if decompile_cache.cache_dir is None:
+        return None
+    return decompile_cache.cache_dir / f"callgraph-{program_key}.bin"
+
+async def crawl_call_graph(program_key: str, calls_only: bool) -> CallGraph | str:
+    """
+    Build the call graph by fetching the references to every function in parallel.
+    Returns an error message on failure.
+    """
+    functions = await async_safe_get("list_functions")
+    if is_error(functions):
+        return functions[0]
+    names, addresses = [], []
+    for line in functions:
+        if line.strip():
+            name, address = parse_symbol_line("function", line)
+            names.append(name)
+            addresses.append(address)
+    by_name = {}
+    for node, name in enumerate(names):
+        by_name.setdefault(name, node)
+
+    limit = asyncio.Semaphore(max(pool_size, 1))
+
+    async def callers(node: int) -> list:
+        async with limit:
+            return await fetch_all_pages("xrefs_to", {"address": addresses[node]}, XREF_PAGE_SIZE)
+
+    edges = set()
+    listings = await asyncio.gather(*(callers(node) for node in range(len(names))))
+    for node, lines in enumerate(listings):
+        if is_error(lines):
+            return f"{lines[0]} (while fetching references to {names[node]})"
+        for line in lines:
+            match = XREF_LINE.match(line.strip())
+            if not match or match.group(2) is None:
+                continue
+            if calls_only and "CALL" not in match.group(3):
+                continue
+            caller = by_name.get(match.group(2))
+            if caller is not None:
+                edges.add((caller, node))
+    return CallGraph.from_edges(program_key, names, addresses, edges)
+
+async def get_call_graph() -> CallGraph | str:
+    """
+    Return the call graph for the open program, loading a snapshot from
+    --cache-dir if one exists. Returns an error message if it isn't built yet.
+    """
+    global call_graph
+    program_key = await get_program_key()
+    if program_key is None:
+        return "Error: could not identify the open program"
+    if call_graph is not None and call_graph.program_key == program_key:
+        return call_graph
+    path = call_graph_path(program_key)
+    if path is not None and path.exists():
+        call_graph = await asyncio.to_thread(CallGraph.load, path)
+        return call_graph
+    return "Error: call graph not built yet, run build_call_graph first"
+
+def format_node(graph: CallGraph, node: int) -> str:
+    return f"{graph.names[node]} @ {graph.addresses[node]}"
+
+@tool()
+async def build_call_graph(calls_only: bool = True) -> str:
+    """
+    Crawl references to every function once (in parallel) and build the call
+    graph used by the transitive caller/callee, call path and SCC tools.
+    With --cache-dir the graph is saved and reloaded on later runs.
+    
+    Args:
+        calls_only: Only keep call references; False keeps every reference made from within a function (default: True)
+        
+    Returns:
+        Summary of the built graph
+    """
+    global call_graph
+    program_key = await get_program_key(refresh=True)
+    if program_key is None:
+        return "Error: could not identify the open program"
+    start = time.perf_counter()
+    graph = await crawl_call_graph(program_key, calls_only)
+    if isinstance(graph, str):
+        return graph
+    call_graph = graph
+    path = call_graph_path(program_key)
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(graph.save, path)
+    return (f"Built call graph: {len(graph.names)} functions, {len(graph.fwd_targets)} edges "
+            f"in {time.perf_counter() - start:.1f} s" + (f", saved to {path}" if path else ""))
+
+async def transitive(function: str, reverse: bool, max_depth: int, limit: int) -> list:
+    graph = await get_call_graph()
+    if isinstance(graph, str):
+        return [graph]
+    node = graph.resolve(function)
+    if node is None:
+        return [f"Error: function {function!r} not found in call graph"]
+    reached = graph.reachable(node, reverse, max_depth)
+    lines = [f"{depth}: {format_node(graph, other)}" for other, depth in reached[:limit]]
+    if len(reached) > limit:
+        lines.append(f"[{len(reached) - limit} more not shown]")
+    return lines
+
+@tool()
+async def get_transitive_callers(function: str, max_depth: int = 0, limit: int = 1000) -> list:
+    """
+    Get every function that can reach the given function through calls, from the local call graph.
+    
+    Args:
+        function: Function name or address
+        max_depth: Maximum call depth to follow, 0 for unlimited (default: 0)
+        limit: Maximum number of functions to return (default: 1000)
+        
+    Returns:
+        List of "depth: name @ address" lines, nearest callers first
+    """
+    return await transitive(function, True, max_depth, limit)
+
+@tool()
+async def get_transitive_callees(function: str, max_depth: int = 0, limit: int = 1000) -> list:
+    """
+    Get every function reachable through calls from the given function, from the local call graph.
+    
+    Args:
+        function: Function name or address
+        max_depth: Maximum call depth to follow, 0 for unlimited (default: 0)
+        limit: Maximum number of functions to return (default: 1000)
+        
+    Returns:
+        List of "depth: name @ address" lines, nearest callees first
+    """
+    return await transitive(function, False, max_depth, limit)
+
+@tool()
+async def find_call_path(source: str, target: str) -> list:
+    """
+    Find a shortest call chain from one function to another, from the local call graph.
+    
+    Args:
+        source: Calling function name or address
+        target: Called function name or address
+        
+    Returns:
+        Functions along the path from source to target
+    """
+    graph = await get_call_graph()
+    if isinstance(graph, str):
+        return [graph]
+    nodes = [graph.resolve(source), graph.resolve(target)]
+    for function, node in zip((source, target), nodes):
+        if node is None:
+            return [f"Error: function {function!r} not found in call graph"]
+    path = graph.shortest_path(*nodes)
+    if path is None:
+        return [f"No call path from {source} to {target}"]
+    return [format_node(graph, node) for node in path]
+
+@tool()
+async def get_call_graph_sccs(min_size: int = 2, limit: int = 100) -> list:
+    """
+    List strongly connected components (mutually recursive function groups) of the call graph.
+    
+    Args:
+        min_size: Smallest component size to report (default: 2)
+        limit: Maximum number of components to return, largest first (default: 100)
+        
+    Returns:
+        One line per component: its size followed by its member functions
+    """
+    graph = await get_call_graph()
+    if isinstance(graph, str):
+        return [graph]
+    components = [c for c in graph.sccs() if len(c) >= min_size]
+    components.sort(key=len, reverse=True)
+    return [f"{len(c)}: " + ", ".join(graph.names[node] for node in c) for c in components[:limit]]
+
+# Operations accepted by batch_apply, mapped to the tools that perform them
+BATCH_OPERATIONS = {
+    "rename_function": rename_function,
+    "rename_data": rename_data,
+    "rename_variable": rename_variable,
+    "rename_function_by_address": rename_function_by_address,
+    "set_decompiler_comment": set_decompiler_comment,
+    "set_disassembly_comment": set_disassembly_comment,
+    "set_function_prototype": set_function_prototype,
+    "set_local_variable_type": set_local_variable_type,
+}
+
+# How the Ghidra plugin's edit endpoints report failure (successes read e.g. "Renamed successfully"),
+# plus the bridge's own error results
+FAILURE_PREFIXES = (
+    "Error", "Request failed", "Failed to", "Rename failed",
+    "No program loaded", "Function not found", "Variable not found",
+)
+
+def is_failure(result: str) -> bool:
+    return result.startswith(FAILURE_PREFIXES)
+
+@tool()
+async def batch_apply(operations: list[dict], concurrency: int = DEFAULT_BATCH_CONCURRENCY) -> list:
+    """
+    Apply many renames, comments and type changes in one call, pipelining the
+    requests over the pooled connection.
+    
+    Args:
+        operations: List of operations, each a dict with an "op" key naming one of
+            rename_function, rename_data, rename_variable, rename_function_by_address,
+            set_decompiler_comment, set_disassembly_comment, set_function_prototype,
+            set_local_variable_type, plus that tool's arguments, e.g.
+            {"op": "rename_function_by_address", "function_address": "0x401000", "new_name": "main"}
+        concurrency: Maximum operations in flight (default: 4); use 1 when later
+            operations depend on earlier ones, e.g. renaming then retyping by the new name
+        
+    Returns:
+        One result line per operation in input order, followed by a timing summary
+    """
+    if not operations:
+        return ["Error: no operations given"]
+    limit = asyncio.Semaphore(max(1, min(concurrency, pool_size)))
+
+    async def apply(op: dict) -> tuple:
+        args = dict(op)
+        name = args.pop("op", None)
+        operation = BATCH_OPERATIONS.get(name)
+        if operation is None:
+            return name, f"Error: unknown operation {name!r}", 0.0
+        try:
+            inspect.signature(operation).bind(**args)
+        except TypeError as e:
+            return name, f"Error: bad arguments: {e}", 0.0
+        async with limit:
+            start = time.perf_counter()
+            try:
+                result = await operation(**args)
+            except Exception as e:
+                result = f"Error: {type(e).__name__}: {e}"
+            return name, result, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(apply(op) for op in operations))
+    elapsed = time.perf_counter() - start
+
+    lines = []
+    failed = 0
+    for i, (name, result, duration) in enumerate(results):
+        if is_failure(result):
+            failed += 1
+        lines.append(f"[{i}] {name}: {result} ({duration * 1000:.1f} ms)")
+    lines.append(
+        f"Applied {len(results)} operations: {len(results) - failed} ok, {failed} failed "
+        f"in {elapsed * 1000:.1f} ms ({len(results) / elapsed:.1f} ops/s)"
+    )
+    return lines
+
+@tool()
+async def get_decompile_cache_stats() -> str:
+    """
+    Report decompile cache size and hit/miss counters.
+    """
+    return "\n".join(f"{k}: {v}" for k, v in decompile_cache.stats().items())
+
+def format_stats(kind: str, stats: dict) -> list:
+    lines = []
+    for name, st in sorted(stats.items()):
+        lines.append(
+            f"{kind} {name}: calls={st.count} errors={st.errors} bytes={st.bytes} "
+            f"p50={st.percentile(0.5) * 1000:.1f}ms p95={st.percentile(0.95) * 1000:.1f}ms "
+            f"p99={st.percentile(0.99) * 1000:.1f}ms total={st.total:.2f}s"
+        )
+    return lines
+
+@tool()
+async def bridge_stats() -> list:
+    """
+    Report per-tool and per-Ghidra-endpoint call counts, errors, bytes transferred
+    and p50/p95/p99 latencies, plus cache hits, coalesced requests and
+    request queue (backpressure) state.
+    """
+    cache = decompile_cache.stats()
+    return format_stats("tool", tool_stats) + format_stats("endpoint", endpoint_stats) + [
+        f"cache decompile: hits={cache['hits']} misses={cache['misses']} entries={cache['entries']}",
+        f"cache listing: hits={listing_cache_hits} misses={listing_cache_misses} entries={len(_listing_cache)}",
+        f"coalesced requests: {coalesced_requests}",
+        "limiter: " + " ".join(f"{k}={v}" for k, v in limiter.stats().items()),
+    ]
+
+def render_metrics() -> str:
+    """
+    Render the bridge statistics in the Prometheus text exposition format.
+    """
+    lines = []
+    for kind, stats in (("tool", tool_stats), ("endpoint", endpoint_stats)):
+        prefix = f"ghidra_bridge_{kind}"
+        lines += [
+            f"# TYPE {prefix}_latency_seconds summary",
+            f"# TYPE {prefix}_errors_total counter",
+            f"# TYPE {prefix}_bytes_total counter",
+        ]
+        for name, st in sorted(stats.items()):
+            label = f'{kind}="{name}"'
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'{prefix}_latency_seconds{{{label},quantile="{q}"}} {st.percentile(q):.6f}')
+            lines.append(f"{prefix}_latency_seconds_sum{{{label}}} {st.total:.6f}")
+            lines.append(f"{prefix}_latency_seconds_count{{{label}}} {st.count}")
+            lines.append(f"{prefix}_errors_total{{{label}}} {st.errors}")
+            lines.append(f"{prefix}_bytes_total{{{label}}} {st.bytes}")
+    lines.append("# TYPE ghidra_bridge_cache_hits_total counter")
+    lines.append("# TYPE ghidra_bridge_cache_misses_total counter")
+    for cache, hits, misses in (("decompile", decompile_cache.hits, decompile_cache.misses),
+                                ("listing", listing_cache_hits, listing_cache_misses)):
+        lines.append(f'ghidra_bridge_cache_hits_total{{cache="{cache}"}} {hits}')
+        lines.append(f'ghidra_bridge_cache_misses_total{{cache="{cache}"}} {misses}')
+    limits = limiter.stats()
+    lines += [
+        "# TYPE ghidra_bridge_coalesced_requests_total counter",
+        f"ghidra_bridge_coalesced_requests_total {coalesced_requests}",
+        "# TYPE ghidra_bridge_active_requests gauge",
+        f"ghidra_bridge_active_requests {limits['active']}",
+        "# TYPE ghidra_bridge_queued_requests gauge",
+        f"ghidra_bridge_queued_requests {limits['queued']}",
+        "# TYPE ghidra_bridge_rejected_requests_total counter",
+        f"ghidra_bridge_rejected_requests_total {limits['rejected']}",
+    ]
+    return "\n".join(lines) + "\n"
 
 def main():
     parser = argparse.ArgumentParser(description="MCP server for Ghidra")
@@ -297,12 +1659,55 @@ def main():
                         help="Port to run MCP server on (only used for sse), default: 8081")
     parser.add_argument("--transport", type=str, default="stdio", choices=["stdio", "sse"],
                         help="Transport protocol for MCP, default: stdio")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help=f"Max pooled connections to the Ghidra server, default: {DEFAULT_POOL_SIZE}")
+    parser.add_argument("--keepalive-expiry", type=float, default=DEFAULT_KEEPALIVE_EXPIRY,
+                        help=f"Seconds an idle pooled connection is kept open, default: {DEFAULT_KEEPALIVE_EXPIRY}")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Default request timeout in seconds (decompile endpoints use longer ones), default: {DEFAULT_TIMEOUT}")
+    parser.add_argument("--bulk-parallelism", type=int, default=DEFAULT_BULK_PARALLELISM,
+                        help=f"Listing pages fetched concurrently by bulk tools, default: {DEFAULT_BULK_PARALLELISM}")
+    parser.add_argument("--max-concurrency", type=int,
+                        help="Max requests in flight to Ghidra across all clients, default: the pool size")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f"Max requests waiting for a slot before new ones are rejected, 0 for unbounded, default: {DEFAULT_MAX_QUEUE}")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_ENTRIES,
+                        help=f"Max decompiled functions kept in the cache, default: {DEFAULT_CACHE_ENTRIES}")
+    parser.add_argument("--cache-bytes", type=int, default=DEFAULT_CACHE_BYTES,
+                        help=f"Max total size of cached decompiler output, default: {DEFAULT_CACHE_BYTES}")
+    parser.add_argument("--cache-dir", type=str,
+                        help="Directory to persist the decompile cache and call graph in, keyed by program "
+                             "(disabled by default, requires --program-id)")
+    parser.add_argument("--program-id", type=str,
+                        help="Name of the open program, e.g. its path or hash; caches are only persisted under this "
+                             "name because the Ghidra plugin does not identify programs")
+    parser.add_argument("--record-trace", type=str,
+                        help="Record every Ghidra request/response to this gzip JSON Lines file for ghidra_bridge_bench.py")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Serve Prometheus-style metrics at /metrics (only used for sse)")
     args = parser.parse_args()
     
     # Use the global variable to ensure it's properly updated
-    global ghidra_server_url
+    global ghidra_server_url, pool_size, keepalive_expiry, default_timeout, program_id, bulk_parallelism, trace_file
     if args.ghidra_server:
         ghidra_server_url = args.ghidra_server
+    pool_size = args.pool_size
+    keepalive_expiry = args.keepalive_expiry
+    default_timeout = args.timeout
+    program_id = args.program_id
+    bulk_parallelism = args.bulk_parallelism
+    limiter.limit = args.max_concurrency or pool_size
+    limiter.max_queue = args.max_queue
+    decompile_cache.max_entries = args.cache_size
+    decompile_cache.max_bytes = args.cache_bytes
+    if args.cache_dir and not args.program_id:
+        # A fingerprint alone can collide between programs, which would load another program's results
+        logger.warning("--cache-dir requires --program-id, caches will not be persisted")
+    elif args.cache_dir:
+        decompile_cache.cache_dir = Path(args.cache_dir).expanduser()
+    if args.record_trace:
+        trace_file = gzip.open(args.record_trace, "at", encoding="utf-8")
+        atexit.register(trace_file.close)
     
     if args.transport == "sse":
         try:
@@ -323,6 +1728,18 @@ def main():
             else:
                 mcp.settings.port = 8081
 
+            if args.metrics:
+                if hasattr(mcp, "custom_route"):
+                    from starlette.responses import PlainTextResponse
+
+                    @mcp.custom_route("/metrics", methods=["GET"])
+                    async def metrics(request):
+                        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+                    logger.info(f"Serving metrics on http://{mcp.settings.host}:{mcp.settings.port}/metrics")
+                else:
+                    logger.warning("This mcp version has no custom routes, --metrics is ignored")
+
             logger.info(f"Connecting to Ghidra server at {ghidra_server_url}")
             logger.info(f"Starting MCP server on http://{mcp.settings.host}:{mcp.settings.port}/sse")
             logger.info(f"Using transport: {args.transport}")
@@ -1,7 +1,15 @@
-# ga_probe.py (logs only failed requests)
+# ga_probe.py (logs only failed requests, to LOGDIR/failures.jsonl)
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import Response
-import os, json, time, httpx, pathlib, traceback
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from array import array
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+import os, re, json, time, httpx, pathlib, traceback, asyncio, hashlib, sqlite3, threading, random
+try:
+    import orjson   # 可选：装了就用它解析/序列化请求体，明显快于标准库 json
+except ImportError:
+    orjson = None
 
 UPSTREAM = os.getenv("UPSTREAM", "https://open.bigmodel.cn/api/paas/v4")
 REWRITE  = os.getenv("REWRITE",  "1")         # 1=把 /v1/* 改写到智谱路径
@@ -10,6 +18,25 @@ HTTP2    = os.getenv("HTTP2", "0") == "1"     # 需要 httpx[http2]，默认关
 EMB_DIM  = os.getenv("EMBEDDING_DIM", "").strip()  # 例：export EMBEDDING_DIM=1024
 THRESH   = int(os.getenv("LOG_THRESHOLD", "400"))  # 仅记录 >= THRESH 的响应
 PREV_N   = int(os.getenv("PREVIEW_BYTES", "2048"))
+MAX_CONN = int(os.getenv("MAX_CONNECTIONS", "100"))          # 上游连接池上限
+MAX_KEEP = int(os.getenv("MAX_KEEPALIVE", "20"))             # 池中最多保留的空闲连接
+KEEP_EXP = float(os.getenv("KEEPALIVE_EXPIRY", "30"))        # 空闲连接保留秒数
+STREAM   = os.getenv("STREAM", "1") == "1"    # 1=边收边转发上游响应（SSE 流式输出不再被整体缓冲）
+EMB_CACHE    = os.getenv("EMBED_CACHE", "").strip()           # 例：export EMBED_CACHE=/tmp/ghidrassist_debug/embed.sqlite
+EMB_CACHE_MB = float(os.getenv("EMBED_CACHE_MB", "512"))      # 缓存文件中向量总大小上限，超出按最久未用淘汰
+BATCH_MS     = float(os.getenv("EMBED_BATCH_MS", "0"))        # >0 时把并发 embedding 请求攒这么多毫秒后合并发送
+BATCH_MAX    = int(os.getenv("EMBED_BATCH_MAX", "64"))        # 单次合并请求的最大输入条数
+LOG_QUEUE    = int(os.getenv("LOG_QUEUE", "1000"))            # 待写日志队列上限，满了直接丢弃并计数
+LOG_MAX_MB   = float(os.getenv("LOG_MAX_MB", "50"))           # 单个日志文件超过该大小就轮转
+LOG_ROTATE_S = float(os.getenv("LOG_ROTATE_S", "86400"))      # 单个日志文件最长写入时间（秒），到期轮转
+LOG_KEEP     = int(os.getenv("LOG_KEEP", "10"))               # 保留的已轮转日志文件数
+UPSTREAMS    = [u.strip() for u in os.getenv("UPSTREAMS", UPSTREAM).split(",") if u.strip()]  # 多个上游轮流使用
+API_KEYS     = [k.strip() for k in os.getenv("UPSTREAM_KEYS", "").split(",") if k.strip()]    # 上游 key 池；空=沿用客户端的 Authorization
+KEY_RPM      = float(os.getenv("KEY_RPM", "0"))                # 每个 key 每分钟请求数上限，0=不限
+KEY_TPM      = float(os.getenv("KEY_TPM", "0"))                # 每个 key 每分钟 token 数上限（按请求体字节/4 估算），0=不限
+MAX_RETRIES  = int(os.getenv("MAX_RETRIES", "3"))              # 429/5xx/连接错误时的最大重试次数
+RETRY_BASE_S = float(os.getenv("RETRY_BASE_S", "0.5"))         # 指数退避的基数
+RETRY_MAX_S  = float(os.getenv("RETRY_MAX_S", "30"))           # 单次退避等待上限
 
 LOGDIR.mkdir(parents=True, exist_ok=True)
 
@@ -31,51 +58,517 @@ HOP_BY_HOP = {
     "content-length","accept-encoding"
 }
 
-app = FastAPI()
+# 连接复用统计：新建 TCP 连接数 / 转发请求数；embedding 缓存命中（按条计）及合并批次数
+STATS = {"requests": 0, "new_connections": 0, "http2_requests": 0,
+         "embed_cache_hits": 0, "embed_cache_misses": 0,
+         "embed_batches": 0, "embed_batched_requests": 0, "retries": 0}
 
-def map_path(path: str) -> str:
+class EmbedCache:
+    """按 (模型, 维度, 输入文本) 哈希存向量的 SQLite 缓存，超出大小上限时淘汰最久未用的条目。"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS emb (key TEXT PRIMARY KEY, vec BLOB, size INTEGER, atime REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS emb_atime ON emb (atime)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM emb").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, dims, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{dims or ''}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i+500]
+                marks = ",".join("?" * len(part))
+                for k, vec in self.db.execute(f"SELECT key, vec FROM emb WHERE key IN ({marks})", part):
+                    found[k] = array("d", vec).tolist()
+            if found:
+                now = time.time()
+                self.db.executemany("UPDATE emb SET atime=? WHERE key=?", [(now, k) for k in found])
+                self.db.commit()
+        return found
+
+    def put_many(self, items: dict):
+        now = time.time()
+        with self.lock:
+            for k, vec in items.items():
+                blob = array("d", vec).tobytes()
+                old = self.db.execute("SELECT size FROM emb WHERE key=?", (k,)).fetchone()
+                self.size += len(blob) - (old[0] if old else 0)
+                self.db.execute("INSERT OR REPLACE INTO emb VALUES (?, ?, ?, ?)", (k, blob, len(blob), now))
+            # 超出上限时淘汰到 90%，避免每次写入都触发
+            if self.size > self.max_bytes:
+                while self.size > self.max_bytes * 0.9:
+                    rows = self.db.execute("SELECT key, size FROM emb ORDER BY atime LIMIT 256").fetchall()
+                    if not rows:
+                        break
+                    self.db.executemany("DELETE FROM emb WHERE key=?", [(k,) for k, _ in rows])
+                    self.size -= sum(n for _, n in rows)
+            self.db.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            n = self.db.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+        return {"entries": n, "bytes": self.size, "max_bytes": self.max_bytes}
+
+EMBED_DB = EmbedCache(EMB_CACHE, int(EMB_CACHE_MB * 1024 * 1024)) if EMB_CACHE else None
+
+class EmbedBatcher:
+    """把发往同一上游、同一密钥、同一模型参数的并发 embedding 请求，
+    在 BATCH_MS 窗口内（或攒满 BATCH_MAX 条）合并成一次上游调用，再把向量分发回各请求。"""
+
+    def __init__(self, wait_s: float, max_items: int):
+        self.wait_s = wait_s
+        self.max_items = max_items
+        self.pending = {}
+
+    async def submit(self, client, dest, fwd_headers, data, inputs):
+        auth = next((v for k, v in fwd_headers.items() if k.lower() == "authorization"), "")
+        params = json.dumps({k: v for k, v in data.items() if k != "input"}, sort_keys=True)
+        key = (dest, auth, params)
+        batch = self.pending.get(key)
+        if batch is not None and batch["count"] + len(inputs) > self.max_items:
+            self.flush(key, batch)
+            batch = None
+        if batch is None:
+            loop = asyncio.get_running_loop()
+            batch = {"items": [], "count": 0, "args": (client, dest, fwd_headers, data)}
+            batch["timer"] = loop.call_later(self.wait_s, self.flush, key, batch)
+            self.pending[key] = batch
+        fut = asyncio.get_running_loop().create_future()
+        batch["items"].append((inputs, fut))
+        batch["count"] += len(inputs)
+        if batch["count"] >= self.max_items:
+            self.flush(key, batch)
+        return await fut
+
+    def flush(self, key, batch):
+        if self.pending.get(key) is batch:
+            del self.pending[key]
+            batch["timer"].cancel()
+            asyncio.ensure_future(self.send(batch))
+
+    async def send(self, batch):
+        items = batch["items"]
+        STATS["embed_batches"] += 1
+        STATS["embed_batched_requests"] += len(items)
+        try:
+            err, vectors, usage, model = await post_embeddings(
+                *batch["args"], [x for inputs, _ in items for x in inputs])
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        if err is not None and len(items) > 1:
+            # 合并请求失败时逐个重发，避免一个坏输入拖累同批的其他请求
+            await asyncio.gather(*(self.send_one(batch["args"], inputs, fut) for inputs, fut in items))
+            return
+        start = 0
+        for inputs, fut in items:
+            if fut.done():
+                start += len(inputs)
+                continue
+            if err is not None:
+                fut.set_result((err, None, None, model))
+            else:
+                # usage 按输入条数比例分摊给各请求
+                share = {k: round(v * len(inputs) / batch["count"]) if isinstance(v, int) else v
+                         for k, v in usage.items()}
+                fut.set_result((None, vectors[start:start + len(inputs)], share, model))
+            start += len(inputs)
+
+    async def send_one(self, args, inputs, fut):
+        try:
+            result = await post_embeddings(*args, inputs)
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+            return
+        if not fut.done():
+            fut.set_result(result)
+
+BATCHER = EmbedBatcher(BATCH_MS / 1000, BATCH_MAX) if BATCH_MS > 0 else None
+
+async def trace_connections(event: str, info: dict):
+    # httpx/httpcore 的 trace 扩展；只有新建连接才会触发 connect_tcp
+    if event == "connection.connect_tcp.complete":
+        STATS["new_connections"] += 1
+
+class KeySlot:
+    """一个上游 key（或一个客户端凭据）的请求/token 令牌桶（每分钟额度，可突发一分钟的量）以及 429 冷却时间。"""
+
+    def __init__(self, key, rpm: float, tpm: float, label: str = None):
+        self.key = key
+        self.label = label or f"...{key[-4:]}"
+        self.rpm = rpm
+        self.tpm = tpm
+        self.req_budget = rpm
+        self.tok_budget = tpm
+        self.updated = time.monotonic()
+        self.cooldown_until = 0.0
+        self.sent = 0
+        self.throttled = 0
+
+    def refill(self, now: float):
+        dt = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.req_budget = min(self.rpm, self.req_budget + dt * self.rpm / 60)
+        if self.tpm:
+            self.tok_budget = min(self.tpm, self.tok_budget + dt * self.tpm / 60)
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        wait = max(self.cooldown_until - now, 0.0)
+        if self.rpm and self.req_budget < 1:
+            wait = max(wait, (1 - self.req_budget) * 60 / self.rpm)
+        if self.tpm:
+            need = min(tokens, self.tpm)   # 超过整桶的大请求等桶满即可
+            if self.tok_budget < need:
+                wait = max(wait, (need - self.tok_budget) * 60 / self.tpm)
+        return wait
+
+    def take(self, tokens: int):
+        self.sent += 1
+        if self.rpm:
+            self.req_budget -= 1
+        if self.tpm:
+            self.tok_budget -= min(tokens, self.tpm)
+
+class Scheduler:
+    """在 key 池和上游池之间分配请求：优先选当前额度最充裕的 key，上游轮询并跳过出错冷却中的。
+    没有 key 池时按客户端的 Authorization 各自限速和冷却，一个客户端被 429 不会拖住其他客户端。"""
+
+    def __init__(self, keys: list, upstreams: list, rpm: float, tpm: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.slots = [KeySlot(k, rpm, tpm) for k in keys]
+        self.client_slots = {}
+        self.upstreams = upstreams
+        self.down_until = {u: 0.0 for u in upstreams}
+        self.next = 0
+
+    def client_slot(self, auth: str) -> KeySlot:
+        ident = hashlib.sha256(auth.encode("utf-8")).hexdigest()[:8]   # 不在内存/统计里保留明文凭据
+        slot = self.client_slots.get(ident)
+        if slot is None:
+            if len(self.client_slots) >= 1024:
+                # 丢掉已经空闲（不在冷却、额度已回满）的客户端，防止无限增长
+                now = time.monotonic()
+                for k, old in list(self.client_slots.items()):
+                    old.refill(now)
+                    if old.wait_time(old.tpm, now) <= 0 and (not old.rpm or old.req_budget >= old.rpm):
+                        del self.client_slots[k]
+            slot = self.client_slots[ident] = KeySlot(None, self.rpm, self.tpm, f"client {ident}")
+        return slot
+
+    async def acquire(self, tokens: int, auth: str = "") -> KeySlot:
+        slots = self.slots or [self.client_slot(auth)]
+        while True:
+            now = time.monotonic()
+            for slot in slots:
+                slot.refill(now)
+            wait, _, slot = min((slot.wait_time(tokens, now), -slot.req_budget, i)
+                                for i, slot in enumerate(slots))
+            slot = slots[slot]
+            if wait <= 0:
+                slot.take(tokens)
+                return slot
+            await asyncio.sleep(wait)
+
+    async def upstream(self) -> str:
+        while True:
+            now = time.monotonic()
+            for i in range(len(self.upstreams)):
+                u = self.upstreams[(self.next + i) % len(self.upstreams)]
+                if self.down_until[u] <= now:
+                    self.next = (self.next + i + 1) % len(self.upstreams)
+                    return u
+            await asyncio.sleep(min(self.down_until.values()) - now)
+
+    async def backoff(self, upstream: str, delay: float):
+        # 有多个上游时让出错的上游冷却、其他请求换别的上游；只有一个上游时只让当前请求自己等，
+        # 否则一个 5xx 会让所有请求一起停下
+        if len(self.upstreams) > 1:
+            self.down_until[upstream] = time.monotonic() + delay
+        else:
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "keys": [{"key": s.label, "sent": s.sent,
+                      "throttled": s.throttled, "cooldown_s": round(max(s.cooldown_until - now, 0), 1),
+                      "request_budget": round(s.req_budget, 1) if s.rpm else None,
+                      "token_budget": round(s.tok_budget) if s.tpm else None} for s in self.slots + list(self.client_slots.values())],
+            "upstreams": {u: round(max(t - now, 0), 1) for u, t in self.down_until.items()},
+        }
+
+SCHED = Scheduler(API_KEYS, UPSTREAMS, KEY_RPM, KEY_TPM)
+
+def retry_delay(attempt: int, retry_after) -> float:
+    # 有 Retry-After 就照办（加一点抖动），否则全抖动指数退避
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_S) + random.uniform(0, RETRY_BASE_S)
+    return random.uniform(0, min(RETRY_MAX_S, RETRY_BASE_S * 2 ** attempt))
+
+# 这些错误发生时请求还没发到上游，任何方法都能安全重发；其余传输错误（如 ReadTimeout）
+# 上游可能已经在处理，只有幂等方法才重发，免得 chat 之类的 POST 被执行两次
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+async def send_upstream(client, method, dest, body, headers, stream=False) -> httpx.Response:
+    """按调度器选定的 key/上游发送请求；429、5xx 和连接错误按退避重试，最后一次的响应原样返回。"""
+    tokens = max(len(body) // 4, 1)
+    base = UPSTREAM.rstrip("/")
+    auth = next((v for k, v in headers.items() if k.lower() == "authorization"), "")
+    for attempt in range(MAX_RETRIES + 1):
+        slot = await SCHED.acquire(tokens, auth)
+        upstream = await SCHED.upstream()
+        url = upstream.rstrip("/") + dest[len(base):] if dest.startswith(base) else dest
+        hdrs = headers
+        if slot.key:
+            hdrs = {k: v for k, v in headers.items() if k.lower() != "authorization"}
+            hdrs["authorization"] = f"Bearer {slot.key}"
+        up_req = client.build_request(method, url, content=body, headers=hdrs,
+                                      extensions={"trace": trace_connections})
+        try:
+            r = await client.send(up_req, stream=stream)
+        except httpx.TransportError as e:
+            if attempt == MAX_RETRIES or not (isinstance(e, UNSENT_ERRORS) or method.upper() in IDEMPOTENT_METHODS):
+                raise
+            STATS["retries"] += 1
+            await SCHED.backoff(upstream, retry_delay(attempt, None))
+            continue
+        count_request(r)
+        if (r.status_code != 429 and r.status_code < 500) or attempt == MAX_RETRIES:
+            return r
+        delay = retry_delay(attempt, parse_retry_after(r.headers.get("retry-after")))
+        await r.aread()   # 读完错误体再关闭，连接才能回到池里复用
+        await r.aclose()
+        STATS["retries"] += 1
+        if r.status_code == 429:
+            slot.throttled += 1
+            if slot.key or auth:
+                # 这个 key（或这个客户端的凭据）冷却，下次优先换别的 key
+                slot.cooldown_until = time.monotonic() + delay
+            else:
+                # 没有任何凭据时无从区分是谁被限流，只让当前请求等待
+                await asyncio.sleep(delay)
+        else:
+            await SCHED.backoff(upstream, delay)
+
+class LogWriter:
+    """后台写日志：请求处理中只把记录放进有界队列，由单独的任务批量追加到
+    LOGDIR/failures.jsonl（JSON Lines），按大小/时间轮转，队列满时丢弃并计数。"""
+
+    def __init__(self, logdir: pathlib.Path, max_queue: int, max_bytes: int, max_age: float, keep: int):
+        self.path = logdir / "failures.jsonl"
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        self.opened = time.time()
+        self.written = 0
+        self.dropped = 0
+        self.task = None
+
+    def put(self, record: dict):
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # 先把队列里剩下的写完再退出（最多等 5 秒）
+        if self.task is None:
+            return
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+        await asyncio.wait([self.task], timeout=5)
+        self.task.cancel()
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty() and len(batch) < 200:
+                batch.append(self.queue.get_nowait())
+            records = [r for r in batch if r is not None]
+            if records:
+                try:
+                    await asyncio.to_thread(self.write, records)
+                    self.written += len(records)
+                except Exception:
+                    self.dropped += len(records)
+            if None in batch:
+                return
+
+    def write(self, records: list):
+        self.maybe_rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def maybe_rotate(self):
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            self.opened = time.time()
+            return
+        if size < self.max_bytes and time.time() - self.opened < self.max_age:
+            return
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time()*1000)%1000:03d}"
+        self.path.rename(self.path.with_name(f"failures-{stamp}.jsonl"))
+        self.opened = time.time()
+        for old in sorted(self.path.parent.glob("failures-*.jsonl"))[:-self.keep or None]:
+            old.unlink(missing_ok=True)
+
+LOGGER = LogWriter(LOGDIR, LOG_QUEUE, int(LOG_MAX_MB * 1024 * 1024), LOG_ROTATE_S, LOG_KEEP)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 整个进程共用一个上游 client，连接（及 HTTP/2 多路复用）在请求间复用
+    app.state.client = httpx.AsyncClient(
+        http2=HTTP2, timeout=60, follow_redirects=True,
+        limits=httpx.Limits(max_connections=MAX_CONN,
+                            max_keepalive_connections=MAX_KEEP,
+                            keepalive_expiry=KEEP_EXP),
+    )
+    LOGGER.start()
+    try:
+        yield
+    finally:
+        await LOGGER.stop()
+        await app.state.client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+def json_loads(b: bytes):
+    if orjson:
+        try:
+            return orjson.loads(b)
+        except orjson.JSONDecodeError:
+            pass   # 例如超过 64 位的整数，交给标准库
+    return json.loads(b)
+
+def json_dumps(data) -> bytes:
+    if orjson:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+BASE = UPSTREAM.rstrip("/")
+try:
+    EMB_DIM_N = int(EMB_DIM) if EMB_DIM else None
+except ValueError:
+    EMB_DIM_N = None
+
+# 路由表：(请求路径后缀, 上游路径, 请求类型)，按顺序匹配
+ROUTES = (
+    ("/v1/embeddings", "/embeddings", "embeddings"),
+    ("/v1/chat/completions", "/chat/completions", "chat"),
+)
+
+def json_strings(values) -> re.Pattern:
+    # 匹配作为 JSON 字符串出现的任一值；转义引号里的同名文本不会命中
+    return re.compile(b'"(?:' + b"|".join(re.escape(v.encode("utf-8")) for v in values) + b')"')
+
+# 请求类型 -> (模型映射, 预筛选正则)；正文里不含任何待映射模型名时完全不解析 JSON
+REWRITE_RULES = {
+    "embeddings": (EMBED_MODEL_MAP, json_strings(list(EMBED_MODEL_MAP) + (["embedding-3"] if EMB_DIM_N is not None else []))),
+    "chat": (CHAT_MODEL_MAP, json_strings(CHAT_MODEL_MAP)),
+}
+
+@lru_cache(maxsize=4096)
+def route(path: str):
+    """返回 (上游 URL, 请求类型)；请求类型为 "embeddings"/"chat"/None。"""
+    kind = next((k for suffix, _, k in ROUTES if path.endswith(suffix)), None)
     if REWRITE != "1":
-        return f"{UPSTREAM.rstrip('/')}/{path.lstrip('/')}"
-    if path.endswith("/v1/embeddings"):
-        return f"{UPSTREAM.rstrip('/')}/embeddings"
-    if path.endswith("/v1/chat/completions"):
-        return f"{UPSTREAM.rstrip('/')}/chat/completions"
+        return f"{BASE}/{path.lstrip('/')}", kind
+    for suffix, target, k in ROUTES:
+        if path.endswith(suffix):
+            return BASE + target, k
     if path in ("/v1", "/v1/"):
-        return f"{UPSTREAM.rstrip('/')}/"
-    return f"{UPSTREAM.rstrip('/')}/{path.lstrip('/').replace('v1/', '', 1)}"
+        return f"{BASE}/", kind
+    return f"{BASE}/{path.lstrip('/').replace('v1/', '', 1)}", kind
 
-def maybe_rewrite_body(path: str, headers: dict, body_bytes: bytes):
-    ct = headers.get("content-type","").lower()
-    if "application/json" not in ct:
+def maybe_rewrite_body(kind, headers, body_bytes: bytes):
+    rule = REWRITE_RULES.get(kind)
+    if rule is None or "application/json" not in headers.get("content-type","").lower():
+        return body_bytes, None
+    model_map, candidates = rule
+    if not candidates.search(body_bytes):
         return body_bytes, None
     try:
-        data = json.loads(body_bytes.decode("utf-8"))
+        data = json_loads(body_bytes)
     except Exception:
         return body_bytes, None
+    if not isinstance(data, dict):
+        return body_bytes, None
 
     changed = {}
-    if path.endswith("/v1/embeddings"):
-        model = str(data.get("model",""))
-        new_model = EMBED_MODEL_MAP.get(model)
-        if new_model:
-            data["model"] = new_model
-            changed["model"] = {"from": model, "to": new_model}
-        if EMB_DIM and str(data.get("model")) == "embedding-3" and "dimensions" not in data:
-            try:
-                data["dimensions"] = int(EMB_DIM)
-                changed["dimensions"] = int(EMB_DIM)
-            except ValueError:
-                pass
-    elif path.endswith("/v1/chat/completions"):
-        model = str(data.get("model",""))
-        new_model = CHAT_MODEL_MAP.get(model)
-        if new_model:
-            data["model"] = new_model
-            changed["model"] = {"from": model, "to": new_model}
-
-    if changed:
-        return json.dumps(data, ensure_ascii=False).encode("utf-8"), changed
-    return body_bytes, None
+    model = str(data.get("model",""))
+    new_model = model_map.get(model)
+    if new_model:
+        data["model"] = new_model
+        changed["model"] = {"from": model, "to": new_model}
+    if (kind == "embeddings" and EMB_DIM_N is not None
+            and str(data.get("model")) == "embedding-3" and "dimensions" not in data):
+        data["dimensions"] = EMB_DIM_N
+        changed["dimensions"] = EMB_DIM_N
+    if not changed:
+        return body_bytes, None
+
+    # 只改动相关字段的字节，大批量 input 原样保留；定位不唯一时退回整体序列化
+    patched = body_bytes
+    if new_model:
+        hits = list(re.finditer(rb'"model"\s*:\s*' + re.escape(json.dumps(model).encode("utf-8")), patched))
+        if len(hits) != 1:
+            return json_dumps(data), changed
+        m = hits[0]
+        patched = patched[:m.start()] + b'"model":' + json.dumps(new_model).encode("utf-8") + patched[m.end():]
+    if "dimensions" in changed:
+        i = patched.index(b"{") + 1
+        patched = patched[:i] + b'"dimensions":%d,' % EMB_DIM_N + patched[i:]
+    return patched, changed
+
+@app.get("/__probe/metrics")
+async def metrics():
+    n = STATS["requests"]
+    looked = STATS["embed_cache_hits"] + STATS["embed_cache_misses"]
+    return {
+        **STATS,
+        "connection_reuse_rate": round(1 - STATS["new_connections"] / n, 4) if n else None,
+        "embed_cache_hit_rate": round(STATS["embed_cache_hits"] / looked, 4) if looked else None,
+        "embed_cache": EMBED_DB.stats() if EMBED_DB else None,
+        "scheduler": SCHED.stats(),
+        "logs": {"written": LOGGER.written, "dropped": LOGGER.dropped, "queued": LOGGER.queue.qsize()},
+        "limits": {"max_connections": MAX_CONN, "max_keepalive": MAX_KEEP,
+                   "keepalive_expiry": KEEP_EXP, "http2": HTTP2},
+    }
 
 @app.api_route("/{full_path:path}", methods=["GET","POST","PUT","DELETE","PATCH"])
 async def catch_all(req: Request, full_path: str):
@@ -87,20 +580,18 @@ async def catch_all(req: Request, full_path: str):
     try:
         body = await req.body()
         # 先准备“若失败才写”的请求摘要（去掉 Authorization）
+        # 请求体原样保存，只有真正落盘时才解析成 JSON
         hdrs_log = dict(req.headers)
         had_auth = bool(hdrs_log.pop("authorization", None))
-        try:
-            body_preview = json.loads(body.decode("utf-8"))
-        except Exception:
-            body_preview = body[:PREV_N].decode("utf-8","ignore")
+        raw_body = body
+        dest, kind = route(f"/{full_path}")
 
         # 可能重写模型名/维度（仅影响转发，不立即落盘）
-        rewritten_body, rewrites = maybe_rewrite_body(f"/{full_path}", req.headers, body)
+        rewritten_body, rewrites = maybe_rewrite_body(kind, req.headers, body)
         if rewrites:
             body = rewritten_body
             hdrs_log["__rewrites__"] = rewrites
 
-        dest = map_path(f"/{full_path}")
         if req.url.query:
             dest += f"?{req.url.query}"
 
@@ -109,27 +600,134 @@ async def catch_all(req: Request, full_path: str):
         if "content-type" not in {k.lower() for k in fwd_headers}:
             fwd_headers["Content-Type"] = "application/json"
 
-        async with httpx.AsyncClient(http2=HTTP2, timeout=60, follow_redirects=True) as client:
-            r = await client.request(req.method, dest, content=body, headers=fwd_headers)
-
-        # 仅在失败（status >= THRESH）时落盘请求/响应
-        if r.status_code >= THRESH:
-            (LOGDIR/f"{rid}-req.json").write_text(json.dumps({
-                "rid": rid, "method": req.method, "path": f"/{full_path}",
-                "has_auth": had_auth, "headers": hdrs_log, "body": body_preview
-            }, ensure_ascii=False, indent=2))
-            (LOGDIR/f"{rid}-resp.json").write_text(json.dumps({
-                "rid": rid, "status": r.status_code, "headers": dict(r.headers),
-                "preview": r.text[:PREV_N]
-            }, ensure_ascii=False, indent=2))
-
-        return Response(r.content, status_code=r.status_code,
-                        media_type=r.headers.get("content-type","application/json"))
+        client = req.app.state.client
+        req_log = {"rid": rid, "method": req.method, "path": f"/{full_path}",
+                   "has_auth": had_auth, "headers": hdrs_log, "body": raw_body}
+
+        # embedding 请求先查缓存，只把未命中的输入发往上游（可与其他请求合并）
+        if (EMBED_DB or BATCHER) and req.method == "POST" and kind == "embeddings":
+            handled = await handle_embeddings(client, dest, fwd_headers, body, rid, req_log)
+            if handled is not None:
+                return handled
+
+        r = await send_upstream(client, req.method, dest, body, fwd_headers, stream=True)
+        media_type = r.headers.get("content-type","application/json")
+
+        if not STREAM:
+            try:
+                await r.aread()
+            finally:
+                await r.aclose()
+            # 仅在失败（status >= THRESH）时落盘请求/响应
+            if r.status_code >= THRESH:
+                write_failure(rid, req_log, r, r.content[:PREV_N])
+            return Response(r.content, status_code=r.status_code, media_type=media_type)
+
+        async def relay():
+            # 逐块转发，同时只保留前 PREV_N 字节作为失败日志的预览
+            preview = bytearray()
+            try:
+                async for chunk in r.aiter_bytes():
+                    if len(preview) < PREV_N:
+                        preview.extend(chunk[:PREV_N - len(preview)])
+                    yield chunk
+            except Exception as e:
+                # 响应头已发出，只能记录异常并中断连接
+                write_error(rid, e)
+                raise
+            finally:
+                await r.aclose()
+                if r.status_code >= THRESH:
+                    write_failure(rid, req_log, r, bytes(preview))
+
+        return StreamingResponse(relay(), status_code=r.status_code, media_type=media_type)
     except Exception as e:
         # 异常必落盘
-        (LOGDIR/f"{rid}-error.json").write_text(json.dumps({
-            "rid": rid, "error": str(e), "trace": traceback.format_exc()
-        }, ensure_ascii=False, indent=2))
+        write_error(rid, e)
         return Response(json.dumps({"rid":rid,"error":str(e)}, ensure_ascii=False),
                         status_code=500, media_type="application/json")
 
+def count_request(r: httpx.Response):
+    STATS["requests"] += 1
+    if r.http_version == "HTTP/2":
+        STATS["http2_requests"] += 1
+
+async def post_embeddings(client, dest, fwd_headers, data, inputs):
+    """发一次上游 embedding 请求。
+    返回 (失败响应或 None, 按输入顺序的向量, usage, model)。"""
+    payload = dict(data, input=inputs)
+    r = await send_upstream(client, "POST", dest, json_dumps(payload), fwd_headers)
+    model = str(data.get("model", ""))
+    if r.status_code >= 400:
+        return r, None, None, model
+    resp = json_loads(r.content)
+    items = sorted(resp.get("data", []), key=lambda d: d.get("index", 0))
+    if len(items) != len(inputs):
+        raise ValueError(f"upstream returned {len(items)} embeddings for {len(inputs)} inputs")
+    usage = resp.get("usage") or {"prompt_tokens": 0, "total_tokens": 0}
+    return None, [item["embedding"] for item in items], usage, resp.get("model", model)
+
+async def handle_embeddings(client, dest, fwd_headers, body, rid, req_log):
+    """逐条查 embedding 缓存，未命中的合并成一次上游请求（开启合并时与并发请求一起发送），
+    结果按原顺序拼回。请求无法按条处理（token 数组输入、base64 编码等）时返回 None，走普通转发。"""
+    try:
+        data = json_loads(body)
+    except Exception:
+        return None
+    inputs = data.get("input") if isinstance(data, dict) else None
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if not inputs or not isinstance(inputs, list) or not all(isinstance(x, str) for x in inputs):
+        return None
+    if data.get("encoding_format", "float") != "float":
+        return None
+
+    model = str(data.get("model", ""))
+    keys = [EmbedCache.key(model, data.get("dimensions"), x) for x in inputs]
+    found = {}
+    if EMBED_DB:
+        found = await asyncio.to_thread(EMBED_DB.get_many, keys)
+        STATS["embed_cache_hits"] += sum(1 for k in keys if k in found)
+        STATS["embed_cache_misses"] += sum(1 for k in keys if k not in found)
+    misses = [i for i, k in enumerate(keys) if k not in found]
+
+    usage = {"prompt_tokens": 0, "total_tokens": 0}
+    if misses:
+        todo = [inputs[i] for i in misses]
+        if BATCHER:
+            err, vectors, usage, model = await BATCHER.submit(client, dest, fwd_headers, data, todo)
+        else:
+            err, vectors, usage, model = await post_embeddings(client, dest, fwd_headers, data, todo)
+        if err is not None:
+            if err.status_code >= THRESH:
+                write_failure(rid, req_log, err, err.content[:PREV_N])
+            return Response(err.content, status_code=err.status_code,
+                            media_type=err.headers.get("content-type","application/json"))
+        fresh = {keys[i]: vec for i, vec in zip(misses, vectors)}
+        if EMBED_DB:
+            await asyncio.to_thread(EMBED_DB.put_many, fresh)
+        found.update(fresh)
+
+    return JSONResponse({
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": found[k]} for i, k in enumerate(keys)],
+        "model": model,
+        "usage": usage,
+    })
+
+def body_preview(body: bytes):
+    try:
+        return json.loads(body.decode("utf-8"))
+    except Exception:
+        return body[:PREV_N].decode("utf-8","ignore")
+
+def write_failure(rid: str, req_log: dict, r: httpx.Response, preview: bytes):
+    req_log = dict(req_log, body=body_preview(req_log["body"]))
+    LOGGER.put({"rid": rid, "kind": "failure", "time": time.time(), "request": req_log, "response": {
+        "status": r.status_code, "headers": dict(r.headers),
+        "preview": preview.decode("utf-8", "ignore")
+    }})
+
+def write_error(rid: str, e: Exception):
+    LOGGER.put({"rid": rid, "kind": "error", "time": time.time(),
+                "error": str(e), "trace": traceback.format_exc()})
@@ -0,0 +1,354 @@
+# ga_probe_bench.py
+"""
+ga_probe.py 的基准测试。
+
+    # 请求预处理（路由 + 模型名改写 + 日志摘要）吞吐：逐条解析/重新序列化的旧做法 vs 当前实现
+    python ga_probe_bench.py rewrite --inputs 1,64,512 --seconds 2 --json rewrite.json
+    # 本地假上游（OpenAI/智谱兼容的 chat、流式 chat、embeddings），可注入延迟和错误
+    python ga_probe_bench.py stub --port 18400 --latency-ms 20 --error-rate 0.01
+    # 自动拉起假上游和 ga_probe，在各并发度下对比直连与经过代理的延迟、吞吐及代理内存
+    python ga_probe_bench.py load --concurrency 1,8,64 --seconds 5 --env STREAM=1 --json load.json
+"""
+
+import os, sys, json, time, random, asyncio, argparse, statistics, subprocess, httpx
+
+os.environ.setdefault("LOGDIR", "/tmp/ga_probe_bench")
+import ga_probe
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+def embed_body(n: int, model: str) -> bytes:
+    inputs = [f"undefined4 FUN_{i:08x}(int param_1) {{ return param_1 * {i}; }}" for i in range(n)]
+    return json.dumps({"model": model, "input": inputs}, ensure_ascii=False).encode("utf-8")
+
+def chat_body(n: int, model: str) -> bytes:
+    messages = [{"role": "user" if i % 2 == 0 else "assistant",
+                 "content": f"第 {i} 轮：这个函数做了什么？" * 8} for i in range(n)]
+    return json.dumps({"model": model, "messages": messages}, ensure_ascii=False).encode("utf-8")
+
+# (名称, 路径, 生成请求体)；模型名未命中映射的是最常见的直通情况
+CASES = (
+    ("embeddings-passthrough", "/v1/embeddings", lambda n: embed_body(n, "embedding-3")),
+    ("embeddings-mapped", "/v1/embeddings", lambda n: embed_body(n, "text-embedding-3-small")),
+    ("chat-passthrough", "/v1/chat/completions", lambda n: chat_body(n, "glm-4")),
+    ("chat-mapped", "/v1/chat/completions", lambda n: chat_body(n, "gpt-4o")),
+)
+
+def legacy_prepare(path: str, body: bytes):
+    # 旧版 catch_all 每个请求做的事：为日志解析一次、为改写再解析一次，命中时整体重新序列化
+    try:
+        json.loads(body.decode("utf-8"))
+    except Exception:
+        pass
+    try:
+        data = json.loads(body.decode("utf-8"))
+    except Exception:
+        data = None
+    table = ga_probe.EMBED_MODEL_MAP if path.endswith("/v1/embeddings") else ga_probe.CHAT_MODEL_MAP
+    if isinstance(data, dict) and table.get(str(data.get("model", ""))):
+        data["model"] = table[str(data["model"])]
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    base = ga_probe.UPSTREAM.rstrip("/")
+    if path.endswith("/v1/embeddings"):
+        return f"{base}/embeddings", body
+    return f"{base}/chat/completions", body
+
+def current_prepare(path: str, body: bytes):
+    dest, kind = ga_probe.route(path)
+    return dest, ga_probe.maybe_rewrite_body(kind, JSON_HEADERS, body)[0]
+
+def measure(fn, path: str, body: bytes, seconds: float) -> float:
+    n, start = 0, time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(50):
+            fn(path, body)
+        n += 50
+        now = time.perf_counter()
+        if now >= deadline:
+            return n / (now - start)
+
+def rewrite(args):
+    results = []
+    print(f"json backend: {'orjson' if ga_probe.orjson else 'json'}")
+    print(f"{'case':<24} {'inputs':>6} {'bytes':>9} {'legacy req/s':>13} {'current req/s':>14} {'speedup':>8}")
+    for name, path, make in CASES:
+        for n in args.inputs:
+            body = make(n)
+            assert json.loads(legacy_prepare(path, body)[1]) == json.loads(current_prepare(path, body)[1])
+            before = measure(legacy_prepare, path, body, args.seconds)
+            after = measure(current_prepare, path, body, args.seconds)
+            results.append({"case": name, "inputs": n, "bytes": len(body),
+                            "legacy_rps": round(before, 1), "current_rps": round(after, 1)})
+            print(f"{name:<24} {n:>6} {len(body):>9} {before:>13.0f} {after:>14.0f} {after / before:>7.1f}x")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"label": args.label, "orjson": bool(ga_probe.orjson), "rewrite": results}, f, indent=2)
+
+def make_stub(args):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+    app = FastAPI()
+    vectors = {}   # 维度 -> 序列化好的向量；假上游自己的 CPU 开销要尽量小，免得测成它的瓶颈
+
+    async def delay():
+        await asyncio.sleep((args.latency_ms + random.uniform(0, args.jitter_ms)) / 1000)
+
+    def injected_error():
+        if random.random() >= args.error_rate:
+            return None
+        headers = {"retry-after": "0"} if args.error_status == 429 else {}
+        return JSONResponse({"error": {"code": str(args.error_status), "message": "injected by stub"}},
+                            status_code=args.error_status, headers=headers)
+
+    @app.get("/health")
+    async def health():
+        return {"ok": True}
+
+    @app.post("/chat/completions")
+    async def chat(req: Request):
+        data = await req.json()
+        await delay()
+        err = injected_error()
+        if err:
+            return err
+        model = data.get("model", "")
+        if data.get("stream"):
+            async def events():
+                for i in range(args.stream_chunks):
+                    chunk = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                             "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+                    await asyncio.sleep(args.chunk_ms / 1000)
+                yield b"data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+        return {"id": "stub", "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "stub " * args.stream_chunks}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": args.stream_chunks, "total_tokens": args.stream_chunks + 1}}
+
+    @app.post("/embeddings")
+    async def embeddings(req: Request):
+        data = await req.json()
+        await delay()
+        err = injected_error()
+        if err:
+            return err
+        inputs = data.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        dim = int(data.get("dimensions") or args.dim)
+        if dim not in vectors:
+            vectors[dim] = json.dumps([round(random.random(), 6) for _ in range(dim)])
+        items = ",".join(f'{{"object":"embedding","index":{i},"embedding":{vectors[dim]}}}'
+                         for i in range(len(inputs)))
+        body = (f'{{"object":"list","model":{json.dumps(data.get("model", ""))},"data":[{items}],'
+                f'"usage":{{"prompt_tokens":{len(inputs)},"total_tokens":{len(inputs)}}}}}')
+        return Response(body, media_type="application/json")
+
+    return app
+
+def stub(args):
+    import uvicorn
+    uvicorn.run(make_stub(args), host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+# 负载类型 -> (直连上游路径, 经代理路径, 请求体)
+def workloads(inputs: int) -> dict:
+    return {
+        "chat": ("/chat/completions", "/v1/chat/completions", chat_body(4, "gpt-4o")),
+        "stream": ("/chat/completions", "/v1/chat/completions",
+                   json.dumps(dict(json.loads(chat_body(4, "gpt-4o")), stream=True)).encode("utf-8")),
+        "embeddings": ("/embeddings", "/v1/embeddings", embed_body(inputs, "text-embedding-3-small")),
+    }
+
+def spawn(cmd: list, env: dict, url: str) -> subprocess.Popen:
+    proc = subprocess.Popen(cmd, env=dict(os.environ, **env), cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{cmd[2:4]} exited with {proc.returncode}")
+        try:
+            httpx.get(url, timeout=0.5)
+            return proc
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{url} did not come up")
+
+def rss_mb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run_level(base: str, target: int, kinds: list, work: dict, concurrency: int, seconds: float, pid=None):
+    latencies, ttfb, errors, peak = [], [], 0, [rss_mb(pid) if pid else None]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+        deadline = time.monotonic() + seconds
+
+        async def worker(i: int):
+            nonlocal errors
+            n = i
+            while time.monotonic() < deadline:
+                kind = kinds[n % len(kinds)]
+                n += 1
+                path, body = work[kind][target], work[kind][2]
+                start = time.perf_counter()
+                try:
+                    async with client.stream("POST", path, content=body,
+                                             headers={"content-type": "application/json"}) as r:
+                        first = None
+                        async for _ in r.aiter_raw():
+                            if first is None:
+                                first = time.perf_counter()
+                    if r.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                end = time.perf_counter()
+                latencies.append(end - start)
+                if kind == "stream" and first is not None:
+                    ttfb.append(first - start)
+
+        async def sample_memory():
+            while time.monotonic() < deadline:
+                mb = rss_mb(pid)
+                if mb is not None:
+                    peak[0] = max(peak[0] or 0, mb)
+                await asyncio.sleep(0.1)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)), *([sample_memory()] if pid else []))
+        elapsed = time.perf_counter() - started
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {"requests": len(latencies), "errors": errors, "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": ms(percentile(latencies, 0.5)), "p95_ms": ms(percentile(latencies, 0.95)),
+            "p99_ms": ms(percentile(latencies, 0.99)),
+            "mean_ms": ms(statistics.fmean(latencies)) if latencies else None,
+            "stream_ttfb_p50_ms": ms(percentile(ttfb, 0.5)),
+            "rss_mb": round(peak[0], 1) if peak[0] is not None else None}
+
+def load(args):
+    procs = []
+    stub_url, proxy_url = args.upstream, args.proxy
+    env = dict(kv.split("=", 1) for kv in args.env)
+    try:
+        if not stub_url:
+            stub_url = f"http://127.0.0.1:{args.stub_port}"
+            procs.append(spawn([sys.executable, os.path.abspath(__file__), "stub", "--port", str(args.stub_port),
+                                "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                                "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+                                "--stream-chunks", str(args.stream_chunks), "--chunk-ms", str(args.chunk_ms),
+                                "--dim", str(args.dim)], {}, f"{stub_url}/health"))
+        pid = args.proxy_pid
+        if not proxy_url:
+            proxy_url = f"http://127.0.0.1:{args.proxy_port}"
+            proxy_env = {"UPSTREAM": stub_url, "LOGDIR": os.environ["LOGDIR"], **env}
+            proc = spawn([sys.executable, "-m", "uvicorn", "ga_probe:app", "--host", "127.0.0.1",
+                          "--port", str(args.proxy_port), "--log-level", "warning", "--no-access-log"],
+                         proxy_env, f"{proxy_url}/__probe/metrics")
+            procs.append(proc)
+            pid = proc.pid
+
+        work = workloads(args.inputs)
+        kinds = args.workload
+        results = []
+        print(f"workload: {','.join(kinds)}  stub latency: {args.latency_ms}ms  error rate: {args.error_rate}")
+        print(f"{'conc':>5} {'target':<7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'ttfb ms':>8} {'errors':>7} {'rss MB':>7}")
+        for c in args.concurrency:
+            row = {"concurrency": c}
+            for name, base, target, p in (("direct", stub_url, 0, None), ("proxy", proxy_url, 1, pid)):
+                r = asyncio.run(run_level(base, target, kinds, work, c, args.seconds, p))
+                row[name] = r
+                print(f"{c:>5} {name:<7} {r['rps']:>9.1f} {r['p50_ms'] or 0:>8.2f} {r['p95_ms'] or 0:>8.2f} "
+                      f"{r['p99_ms'] or 0:>8.2f} {r['stream_ttfb_p50_ms'] or 0:>8.2f} {r['errors']:>7} "
+                      f"{r['rss_mb'] if r['rss_mb'] is not None else '-':>7}")
+            d, px = row["direct"], row["proxy"]
+            row["added_ms"] = {k: round(px[k] - d[k], 2) for k in ("p50_ms", "p95_ms", "p99_ms")
+                               if px[k] is not None and d[k] is not None}
+            print(f"{'':>5} {'added':<7} {'':>9} {row['added_ms'].get('p50_ms', 0):>8.2f} "
+                  f"{row['added_ms'].get('p95_ms', 0):>8.2f} {row['added_ms'].get('p99_ms', 0):>8.2f}")
+            results.append(row)
+        if proxy_url:
+            try:
+                metrics = httpx.get(f"{proxy_url}/__probe/metrics", timeout=5).json()
+            except (httpx.HTTPError, ValueError):
+                metrics = None
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"label": args.label, "env": env, "workload": kinds, "seconds": args.seconds,
+                           "stub": {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+                                    "error_rate": args.error_rate, "error_status": args.error_status},
+                           "levels": results, "proxy_metrics": metrics}, f, indent=2)
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+def add_stub_args(p):
+    p.add_argument("--latency-ms", type=float, default=20.0, help="Fixed latency before every response, default: 20")
+    p.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency, uniform in [0, jitter]")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    p.add_argument("--error-status", type=int, default=500, help="Status code of injected errors, default: 500")
+    p.add_argument("--stream-chunks", type=int, default=16, help="SSE chunks per streaming chat response, default: 16")
+    p.add_argument("--chunk-ms", type=float, default=5.0, help="Delay between SSE chunks, default: 5")
+    p.add_argument("--dim", type=int, default=1024, help="Embedding dimension when the request sets none, default: 1024")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for ga_probe.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rw = sub.add_parser("rewrite", help="Requests/second of request routing and body rewriting")
+    rw.add_argument("--inputs", type=lambda s: [int(x) for x in s.split(",")], default=[1, 64, 512],
+                    help="Comma-separated embedding inputs / chat messages per request, default: 1,64,512")
+    rw.add_argument("--seconds", type=float, default=1.0, help="Time spent on each measurement, default: 1")
+    rw.add_argument("--label", default="", help="Label stored in the JSON results, e.g. a git revision")
+    rw.add_argument("--json", help="Write results to this JSON file")
+
+    st = sub.add_parser("stub", help="Run a fake OpenAI/Zhipu-compatible upstream")
+    st.add_argument("--port", type=int, default=18400, help="Listen port, default: 18400")
+    add_stub_args(st)
+
+    ld = sub.add_parser("load", help="Compare latency/throughput direct vs through ga_probe at several concurrencies")
+    ld.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 8, 64],
+                    help="Comma-separated concurrency levels, default: 1,8,64")
+    ld.add_argument("--seconds", type=float, default=5.0, help="Duration of each level and target, default: 5")
+    ld.add_argument("--workload", type=lambda s: s.split(","), default=["chat", "stream", "embeddings"],
+                    help="Comma-separated mix of chat,stream,embeddings, default: all three")
+    ld.add_argument("--inputs", type=int, default=16, help="Inputs per embeddings request, default: 16")
+    ld.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                    help="Environment for the spawned ga_probe (repeatable), e.g. STREAM=0")
+    ld.add_argument("--upstream", help="Use an already running upstream instead of spawning the stub")
+    ld.add_argument("--proxy", help="Use an already running ga_probe instead of spawning one")
+    ld.add_argument("--proxy-pid", type=int, help="PID of --proxy, to sample its memory")
+    ld.add_argument("--stub-port", type=int, default=18400, help="Port for the spawned stub, default: 18400")
+    ld.add_argument("--proxy-port", type=int, default=18401, help="Port for the spawned ga_probe, default: 18401")
+    ld.add_argument("--label", default="", help="Label stored in the JSON results, e.g. a git revision")
+    ld.add_argument("--json", help="Write results to this JSON file")
+    add_stub_args(ld)
+
+    args = parser.parse_args()
+    if args.command == "rewrite":
+        rewrite(args)
+    elif args.command == "stub":
+        stub(args)
+    elif args.command == "load":
+        load(args)
+
+if __name__ == "__main__":
+    main()
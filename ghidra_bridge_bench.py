@@ -0,0 +1,341 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "requests>=2,<3",
+#     "mcp>=1.2.0,<2",
+#     "httpx>=0.24,<1",
+# ]
+# ///
+
+"""
+Offline stand-in for the Ghidra HTTP plugin and benchmarks for bridge_mcp_ghidra.py.
+
+    # capture a trace from a live Ghidra (or run the bridge with --record-trace)
+    python ghidra_bridge_bench.py record trace.jsonl.gz --ghidra-server http://127.0.0.1:8080/
+    # serve the trace as a fake Ghidra plugin
+    python ghidra_bridge_bench.py serve trace.jsonl.gz --port 8080 --latency-ms 2
+    # drive the bridge's MCP tools against the replayed trace
+    python ghidra_bridge_bench.py bench trace.jsonl.gz --latency-ms 2 --json results.json
+"""
+
+import gzip
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import bridge_mcp_ghidra as bridge
+
+DEFAULT_PORT = 18489
+DEFAULT_DEFAULT_POST = "Success (replayed)"
+
+
+def canonical(payload) -> str:
+    if isinstance(payload, dict):
+        return json.dumps(sorted((k, str(v)) for k, v in payload.items()))
+    return payload or ""
+
+
+class Trace:
+    """
+    Recorded request/response pairs, indexed for replay.
+    Paginated GET listings are merged so any offset/limit window inside the
+    recorded range can be served, not only the exact pages that were recorded.
+    """
+
+    def __init__(self, path: str):
+        self.responses = {}
+        self.listings = defaultdict(dict)
+        self.ends = {}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self.add(json.loads(line))
+
+    def add(self, record: dict):
+        method, endpoint, payload = record["m"], record["e"], record["p"]
+        self.responses[(method, endpoint, canonical(payload))] = record
+        if method != "GET" or record["s"] >= 400 or not isinstance(payload, dict):
+            return
+        if "offset" not in payload or "limit" not in payload:
+            return
+        rest = {k: v for k, v in payload.items() if k not in ("offset", "limit")}
+        key = (endpoint, canonical(rest))
+        offset, limit = int(payload["offset"]), int(payload["limit"])
+        lines = record["b"].splitlines()
+        for i, line in enumerate(lines):
+            self.listings[key][offset + i] = line
+        if len(lines) < limit:
+            self.ends[key] = offset + len(lines)
+
+    def lookup(self, method: str, endpoint: str, payload):
+        """
+        Return (status, body, recorded seconds) or None if nothing matches.
+        """
+        record = self.responses.get((method, endpoint, canonical(payload)))
+        if record is not None:
+            return record["s"], record["b"], record["t"]
+        if method != "GET" or "offset" not in payload or "limit" not in payload:
+            return None
+        rest = {k: v for k, v in payload.items() if k not in ("offset", "limit")}
+        key = (endpoint, canonical(rest))
+        if key not in self.listings:
+            return None
+        offset, limit = int(payload["offset"]), int(payload["limit"])
+        lines = self.listings[key]
+        page = []
+        for i in range(offset, offset + limit):
+            if i not in lines:
+                # A gap before the known end of the listing can't be answered
+                if self.ends.get(key, -1) > i or key not in self.ends:
+                    return None
+                break
+            page.append(lines[i])
+        return 200, "\n".join(page), 0.0
+
+    def records(self, method: str = None, endpoint: str = None):
+        for record in self.responses.values():
+            if (method is None or record["m"] == method) and (endpoint is None or record["e"] == endpoint):
+                yield record
+
+
+def make_handler(trace: Trace, latency: float, jitter: float, latency_scale: float, default_post: str):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; without this, delayed ACKs add ~40 ms per response
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status: int, body: str, recorded: float):
+            delay = latency + random.uniform(0, jitter) + recorded * latency_scale
+            if delay > 0:
+                time.sleep(delay)
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            found = trace.lookup("GET", url.path.lstrip("/"), dict(parse_qsl(url.query)))
+            if found is None:
+                self.reply(404, f"No recorded response for {self.path}", 0.0)
+            else:
+                self.reply(*found)
+
+        def do_POST(self):
+            endpoint = urlparse(self.path).path.lstrip("/")
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+            content_type = self.headers.get("Content-Type", "")
+            payload = dict(parse_qsl(body)) if "form-urlencoded" in content_type else body
+            found = trace.lookup("POST", endpoint, payload)
+            if found is None and endpoint in bridge.MUTATING_ENDPOINTS:
+                # Edits are replayed as successes so bulk rename runs can use any target
+                found = 200, default_post, 0.0
+            if found is None:
+                self.reply(404, f"No recorded response for POST {self.path}", 0.0)
+            else:
+                self.reply(*found)
+
+    return ReplayHandler
+
+
+def start_server(trace: Trace, port: int, latency_ms: float, jitter_ms: float,
+                 latency_scale: float, default_post: str) -> ThreadingHTTPServer:
+    handler = make_handler(trace, latency_ms / 1000, jitter_ms / 1000, latency_scale, default_post)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def record(args):
+    """
+    Drive the tools every benchmark suite needs against a live Ghidra, recording the trace.
+    """
+    bridge.trace_file = gzip.open(args.trace, "wt", encoding="utf-8")
+    try:
+        await bridge.get_program_key()
+        print("Recording listings...")
+        for kind in bridge.BULK_LISTINGS:
+            await bridge.bulk_list(kind)
+        functions = await bridge.list_functions()
+        addresses = [bridge.parse_symbol_line("function", line)[1] for line in functions if line.strip()]
+        print(f"Recording decompilation of {min(len(addresses), args.decompile)} functions...")
+        await asyncio.gather(*(bridge.decompile_function_by_address(a) for a in addresses[:args.decompile]))
+        print("Recording xref crawl...")
+        print(await bridge.build_call_graph())
+    finally:
+        bridge.trace_file.close()
+        bridge.trace_file = None
+    print(f"Trace written to {args.trace}")
+
+
+async def run_concurrently(calls: list, concurrency: int):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run(call):
+        async with limit:
+            return await call()
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
+
+def reset_bridge():
+    bridge.tool_stats.clear()
+    bridge.endpoint_stats.clear()
+    bridge.decompile_cache.entries.clear()
+    bridge.decompile_cache.size = 0
+    bridge._listing_cache.clear()
+    bridge.symbol_index = bridge.SymbolIndex()
+    bridge.call_graph = None
+
+
+async def suite_listing(trace: Trace, args):
+    for _ in range(args.repeat):
+        bridge._listing_cache.clear()
+        for kind in bridge.BULK_LISTINGS:
+            await bridge.bulk_list(kind, refresh=True)
+
+
+async def suite_decompile(trace: Trace, args):
+    addresses = [r["p"]["address"] for r in trace.records("GET", "decompile_function")]
+    for _ in range(args.repeat):
+        bridge.decompile_cache.clear()
+        await run_concurrently([lambda a=a: bridge.decompile_function_by_address(a) for a in addresses],
+                               args.concurrency)
+
+
+async def suite_xrefs(trace: Trace, args):
+    for _ in range(args.repeat):
+        bridge.call_graph = None
+        await bridge.build_call_graph()
+
+
+async def suite_rename(trace: Trace, args):
+    record = next(trace.records("GET", "list_functions"), None)
+    lines = record["b"].splitlines() if record else []
+    addresses = [bridge.parse_symbol_line("function", line)[1] for line in lines if line.strip()]
+    ops = [{"op": "rename_function_by_address", "function_address": a, "new_name": f"bench_{i}"}
+           for i, a in enumerate(addresses)]
+    for _ in range(args.repeat):
+        if ops:
+            await bridge.batch_apply(ops, concurrency=args.concurrency)
+
+
+SUITES = {
+    "listing": (suite_listing, "bulk_list"),
+    "decompile": (suite_decompile, "decompile_function_by_address"),
+    "xrefs": (suite_xrefs, "build_call_graph"),
+    "rename": (suite_rename, "rename_function_by_address"),
+}
+
+
+async def bench(args):
+    trace = Trace(args.trace)
+    server = start_server(trace, args.port, args.latency_ms, args.jitter_ms, args.latency_scale, args.default_post)
+    bridge.ghidra_server_url = f"http://127.0.0.1:{args.port}/"
+    bridge.pool_size = args.pool_size
+    bridge.limiter.limit = args.pool_size
+    results = {"label": args.label, "latency_ms": args.latency_ms, "concurrency": args.concurrency, "suites": {}}
+    try:
+        await bridge.get_program_key()
+        for name in args.suites.split(","):
+            suite, tool_name = SUITES[name]
+            reset_bridge()
+            start = time.perf_counter()
+            await suite(trace, args)
+            wall = time.perf_counter() - start
+            st = bridge.tool_stats[tool_name]
+            requests = sum(e.count for e in bridge.endpoint_stats.values())
+            results["suites"][name] = {
+                "wall_s": round(wall, 4),
+                "calls": st.count,
+                "errors": st.errors,
+                "calls_per_s": round(st.count / wall, 2) if wall else 0.0,
+                "ghidra_requests": requests,
+                "requests_per_s": round(requests / wall, 2) if wall else 0.0,
+                "p50_ms": round(st.percentile(0.5) * 1000, 3),
+                "p95_ms": round(st.percentile(0.95) * 1000, 3),
+                "p99_ms": round(st.percentile(0.99) * 1000, 3),
+            }
+    finally:
+        server.shutdown()
+
+    print(f"{'suite':<10} {'calls':>7} {'errors':>6} {'wall s':>8} {'calls/s':>9} {'req/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in results["suites"].items():
+        print(f"{name:<10} {r['calls']:>7} {r['errors']:>6} {r['wall_s']:>8.2f} {r['calls_per_s']:>9.1f} "
+              f"{r['requests_per_s']:>9.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def serve(args):
+    trace = Trace(args.trace)
+    server = start_server(trace, args.port, args.latency_ms, args.jitter_ms, args.latency_scale, args.default_post)
+    print(f"Replaying {len(trace.responses)} recorded requests on http://127.0.0.1:{args.port}/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay server and benchmarks for the Ghidra MCP bridge")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Record a benchmark trace from a live Ghidra server")
+    rec.add_argument("trace", help="Output trace file (gzip JSON Lines)")
+    rec.add_argument("--ghidra-server", default=bridge.DEFAULT_GHIDRA_SERVER,
+                     help=f"Ghidra server URL, default: {bridge.DEFAULT_GHIDRA_SERVER}")
+    rec.add_argument("--decompile", type=int, default=200,
+                     help="Number of functions to decompile, default: 200")
+
+    for name, help_text in (("serve", "Serve a trace as a fake Ghidra HTTP plugin"),
+                            ("bench", "Benchmark the bridge tools against a replayed trace")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("trace", help="Trace recorded with 'record' or the bridge's --record-trace")
+        p.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Replay server port, default: {DEFAULT_PORT}")
+        p.add_argument("--latency-ms", type=float, default=0.0, help="Fixed latency added to every response")
+        p.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency, uniform in [0, jitter]")
+        p.add_argument("--latency-scale", type=float, default=0.0,
+                       help="Also delay by this multiple of the recorded response time, default: 0")
+        p.add_argument("--default-post", default=DEFAULT_DEFAULT_POST,
+                       help="Response to unrecorded mutating POSTs")
+
+    b = sub.choices["bench"]
+    b.add_argument("--suites", default=",".join(SUITES), help=f"Comma-separated suites, default: {','.join(SUITES)}")
+    b.add_argument("--concurrency", type=int, default=8, help="Concurrent tool calls, default: 8")
+    b.add_argument("--pool-size", type=int, default=bridge.DEFAULT_POOL_SIZE,
+                   help=f"Bridge connection pool size, default: {bridge.DEFAULT_POOL_SIZE}")
+    b.add_argument("--repeat", type=int, default=1, help="Times to run each suite, default: 1")
+    b.add_argument("--label", default="", help="Label stored in the JSON results, e.g. a git revision")
+    b.add_argument("--json", help="Write results to this JSON file")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        bridge.ghidra_server_url = args.ghidra_server
+        asyncio.run(record(args))
+    elif args.command == "serve":
+        serve(args)
+    else:
+        unknown = set(args.suites.split(",")) - set(SUITES)
+        if unknown:
+            parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+        asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,562 @@
+import argparse
+import contextlib
+import fnmatch
+import functools
+import json
+import operator
+import re
+import sqlite3
 import subprocess
 import sys
+import threading
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from tqdm import tqdm  # 进度条库
 
-def get_all_commits(repo_dir):
-    """获取所有的 Git 提交哈希。"""
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+INDEX_VERSION = 1
+INDEX_MAX_BLOB = 16 << 20  # 更大的 blob 不建索引，每次都直接扫描
+MAX_ALTERNATIVES = 64      # 正则拆出的“或”分支上限，超过就放弃部分约束
+REPEAT_OPS = tuple(getattr(sre_constants, name) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+                   if hasattr(sre_constants, name))
+ATOMIC_GROUP = getattr(sre_constants, "ATOMIC_GROUP", None)
+
+# 一处匹配；二进制文件的 line_number/text/spans 为 None。spans 是行内的字节偏移 [start, end]
+Match = namedtuple("Match", "commit path line_number text spans")
+
+def compile_regex(regex):
+    """编译成按行匹配的 bytes 正则（^/$ 对应行首行尾，与 git grep 一致）；语法不兼容时返回 None。"""
+    try:
+        return re.compile(regex.encode(), re.MULTILINE)
+    except re.error:
+        return None
+
+def match_spans(pattern, text):
+    if pattern is None:
+        return None
+    return [[m.start(), m.end()] for m in pattern.finditer(text)]
+
+def rev_list_args(revs=(), since=None, until=None):
+    """把版本/时间限制转成 git rev-list（及 git log）参数。
+    路径限制不放在这里：按路径筛提交（history simplification）在给了范围或时间窗口时会漏掉
+    范围内没有改动这些路径、但其中内容匹配的提交，所以路径只交给 git grep 和 tree 遍历。"""
+    args = list(revs) or ["--all"]
+    if since:
+        args.append(f"--since={since}")
+    if until:
+        args.append(f"--until={until}")
+    return args
+
+def path_selected(path, paths):
+    """近似 git pathspec：目录前缀、通配符（* 可跨目录），以 :! 或 :^ 开头的为排除项。"""
+    if not paths:
+        return True
+    included = None
+    for spec in paths:
+        exclude = spec.startswith((":!", ":^"))
+        if exclude:
+            spec = spec[2:]
+        hit = path == spec or path.startswith(spec.rstrip("/") + "/") or fnmatch.fnmatchcase(path, spec)
+        if exclude and hit:
+            return False
+        if not exclude:
+            included = included or hit
+    return included is not False
+
+def may_contain(directory, paths):
+    """目录下是否可能有选中的路径（保守判断：有通配符或只有排除项时都算可能）。"""
+    includes = [spec for spec in paths if not spec.startswith((":!", ":^"))]
+    if not includes:
+        return True
+    for spec in includes:
+        if any(c in spec for c in "*?[") or spec.startswith(directory + "/") or path_selected(directory, [spec]):
+            return True
+    return False
+
+def get_all_commits(repo_dir, rev_args=("--all",)):
+    """获取要搜索的 Git 提交哈希（默认全部）。"""
     try:
         result = subprocess.run(
-            ["git", "rev-list", "--all"],
+            ["git", "rev-list", *rev_args],
             cwd=repo_dir,
             capture_output=True,
             text=True,
             check=True,
         )
-        commits = result.stdout.strip().split("\n")
-        return commits
+        return [c for c in result.stdout.split("\n") if c]
     except subprocess.CalledProcessError as e:
         print(f"Error getting commits: {e.stderr}")
         return []
 
-def search_in_commit(repo_dir, commit, regex):
-    """在指定的提交中使用 git grep 搜索正则表达式。"""
+def iter_commit_matches(repo_dir, commit, regex, pattern=None, paths=()):
+    """在指定的提交中使用 git grep 搜索正则表达式（可限定路径），边读输出边逐条产出 Match，不整体缓冲。
+    提前停止迭代时结束 git grep 进程。"""
+    proc = subprocess.Popen(
+        ["git", "grep", "-z", "-n", "-E", regex, commit, "--", *paths],
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    prefix = len(commit) + 1  # 输出里的文件名形如 "<commit>:<path>"
     try:
-        result = subprocess.run(
-            ["git", "grep", "-E", regex, commit],
+        for raw in proc.stdout:
+            raw = raw.rstrip(b"\n")
+            if b"\0" not in raw:  # "Binary file <commit>:<path> matches"
+                name = raw[len(b"Binary file "):-len(b" matches")]
+                yield Match(commit, name[prefix:].decode("utf-8", "replace"), None, None, None)
+                continue
+            name, number, text = raw.split(b"\0", 2)
+            yield Match(commit, name[prefix:].decode("utf-8", "replace"), int(number),
+                        text.decode("utf-8", "replace"), match_spans(pattern, text))
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+def search_in_commit(repo_dir, commit, regex, pattern=None, paths=()):
+    """在指定的提交中使用 git grep 搜索正则表达式，返回 Match 列表。"""
+    return list(iter_commit_matches(repo_dir, commit, regex, pattern, paths))
+
+def scan_commits(repo_dir, commits, regex, jobs=1, ordered=True, paths=()):
+    """用 jobs 个线程并发对各提交跑 git grep（耗时都在子进程里，线程足够），逐个产出 (commit, 匹配)。
+    ordered 时按提交顺序产出，否则谁先完成先产出；调用方停止迭代时取消尚未开始的任务。
+    jobs 为 1 时匹配以迭代器形式产出，直接流式读取 git grep 的输出。"""
+    pattern = compile_regex(regex)
+    if jobs == 1:
+        for commit in tqdm(commits, desc="Searching commits", unit="commit"):
+            yield commit, iter_commit_matches(repo_dir, commit, regex, pattern, paths)
+        return
+    with tqdm(total=len(commits), desc="Searching commits", unit="commit") as bar, \
+            ThreadPoolExecutor(max_workers=jobs) as pool:
+        todo = iter(commits)
+        pending = deque()
+        window = jobs * 4  # 限制提前提交的任务数，提前终止时浪费的工作有限
+
+        def submit():
+            for commit in todo:
+                future = pool.submit(search_in_commit, repo_dir, commit, regex, pattern, paths)
+                future.add_done_callback(lambda _: bar.update(1))
+                pending.append((commit, future))
+                if len(pending) >= window:
+                    break
+
+        try:
+            submit()
+            while pending:
+                if ordered:
+                    commit, future = pending.popleft()
+                else:
+                    wait([f for _, f in pending], return_when=FIRST_COMPLETED)
+                    commit, future = next(item for item in pending if item[1].done())
+                    pending.remove((commit, future))
+                result = future.result()
+                submit()
+                if result:
+                    yield commit, result
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+class CatFile:
+    """常驻的 git cat-file --batch 进程，按对象 id 读取内容。"""
+
+    def __init__(self, repo_dir):
+        self.proc = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
             cwd=repo_dir,
-            capture_output=True,
-            text=True,
-            check=False,  # Allow no matches
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
         )
-        if result.stdout.strip():
-            return result.stdout.strip()
-        return None
+
+    def read_reply(self):
+        header = self.proc.stdout.readline().split()
+        if len(header) < 3:  # "<id> missing"
+            return None, None
+        data = self.proc.stdout.read(int(header[2]))
+        self.proc.stdout.read(1)  # 结尾的换行
+        return header[1], data
+
+    def read(self, oid):
+        self.proc.stdin.write(oid.encode() + b"\n")
+        self.proc.stdin.flush()
+        return self.read_reply()
+
+    def read_many(self, oids):
+        """流式读取一批对象：另起线程写请求，避免管道双向阻塞。"""
+        def feed():
+            for oid in oids:
+                self.proc.stdin.write(oid.encode() + b"\n")
+            self.proc.stdin.flush()
+
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        for oid in oids:
+            yield (oid,) + self.read_reply()
+        writer.join()
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+def get_all_blobs(repo_dir, commits):
+    """列出这些提交的 tree 里的 blob（去重后的对象 id）。
+    用 --no-walk 逐个展开提交本身，而不是按范围：A..B 会把 A 可达的对象一并排除，
+    范围内没改动过的文件就搜不到了。"""
+    try:
+        objects = subprocess.run(
+            ["git", "rev-list", "--objects", "--no-walk", "--stdin"],
+            cwd=repo_dir,
+            input="\n".join(commits).encode() + b"\n",
+            capture_output=True,
+            check=True,
+        ).stdout
     except subprocess.CalledProcessError as e:
-        print(f"Error searching in commit {commit}: {e.stderr}")
+        print(f"Error listing objects: {e.stderr.decode(errors='replace')}")
+        return []
+    types = subprocess.run(
+        ["git", "cat-file", "--batch-check=%(objectname) %(objecttype)"],
+        cwd=repo_dir,
+        input=b"\n".join(line.split(b" ", 1)[0] for line in objects.splitlines()) + b"\n",
+        capture_output=True,
+        check=True,
+    ).stdout
+    blobs = {}
+    for line in types.decode().splitlines():
+        oid, kind = line.split()
+        if kind == "blob":
+            blobs[oid] = None
+    return list(blobs)
+
+def search_blob(pattern, data):
+    """返回匹配的行 [(行号, 文本, spans)]；二进制文件返回 None 表示“匹配但不打印内容”。"""
+    lines = []
+    pos = 0
+    line_number, counted = 1, 0
+    # 每轮都跳到下一行行首，空匹配（x*、^、$）也能前进；末尾换行之后不再算一行（与 git grep 一致）
+    while pos < len(data):
+        m = pattern.search(data, pos)
+        if not m:
+            return lines
+        if b"\0" in data[:8000]:
+            return None
+        start = data.rfind(b"\n", 0, m.start()) + 1
+        end = data.find(b"\n", m.start())
+        if end < 0:
+            end = len(data)
+        line_number += data.count(b"\n", counted, start)
+        counted = start
+        text = data[start:end]
+        lines.append((line_number, text.decode("utf-8", "replace"), match_spans(pattern, text)))
+        pos = end + 1
+    return lines
+
+def parse_tree(data, oid_len):
+    """解析 tree 对象：逐项返回 (mode, name, oid)。"""
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        yield data[pos:space], data[space + 1:nul], data[nul + 1:nul + 1 + oid_len].hex()
+        pos = nul + 1 + oid_len
+
+def required_literals(node):
+    """从解析后的正则里提取必须出现的字面量，返回“或”的各分支，每个分支是必须同时出现的字面量集合；
+    返回 None 表示无法约束（任何内容都可能匹配）。只做保守的近似：不确定时少给约束。"""
+    alternatives = [set()]
+    run = bytearray()
+
+    def flush():
+        if len(run) >= 3:
+            for alt in alternatives:
+                alt.add(bytes(run))
+        run.clear()
+
+    def conjoin(options):
+        nonlocal alternatives
+        if options is None:
+            return
+        product = [a | b for a in alternatives for b in options]
+        if len(product) <= MAX_ALTERNATIVES:
+            alternatives = product
+
+    for op, av in node:
+        if op is sre_constants.LITERAL:
+            run.append(av)
+            continue
+        flush()
+        if op is sre_constants.SUBPATTERN:
+            add_flags = av[1]
+            if not add_flags & sre_constants.SRE_FLAG_IGNORECASE:
+                conjoin(required_literals(av[-1]))
+        elif op is sre_constants.BRANCH:
+            options = []
+            for branch in av[1]:
+                sub = required_literals(branch)
+                if sub is None:
+                    options = None
+                    break
+                options.extend(sub)
+            if options is not None and len(options) <= MAX_ALTERNATIVES:
+                conjoin(options)
+        elif op in REPEAT_OPS:
+            if av[0] >= 1:
+                conjoin(required_literals(av[2]))
+        elif op is ATOMIC_GROUP:
+            conjoin(required_literals(av))
+    flush()
+    if any(not alt for alt in alternatives):
+        return None
+    return alternatives
+
+def regex_trigrams(regex):
+    """把正则转成候选过滤条件：[{trigram...}, ...]，任一分支的 trigram 全部出现的 blob 才可能匹配。"""
+    try:
+        parsed = sre_parse.parse(regex.encode())
+    except re.error:
         return None
+    if parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return None
+    alternatives = required_literals(parsed)
+    if alternatives is None:
+        return None
+    return [{lit[i:i + 3] for lit in alt for i in range(len(lit) - 2)} for alt in alternatives]
+
+def bloom_bit(trigram, log2_bits):
+    # Fibonacci 散列，取高位
+    return ((int.from_bytes(trigram, "big") * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - log2_bits)
+
+class BlobIndex:
+    """按 blob id 保存内容 trigram 的 Bloom 过滤器（SQLite），每次运行只为新出现的 blob 建索引。"""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or int(row[0]) != INDEX_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS blobs")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+        # bloom 为 NULL 表示太大没建索引
+        self.db.execute("CREATE TABLE IF NOT EXISTS blobs (oid TEXT PRIMARY KEY, log2_bits INTEGER, bloom BLOB)")
+        self.db.commit()
+        self.pending = []
+
+    @staticmethod
+    def signature(data):
+        if len(data) > INDEX_MAX_BLOB:
+            return None, None
+        trigrams = {data[i:i + 3] for i in range(len(data) - 2)}
+        # 约每个 trigram 8 位，误判率约 12%（单散列）
+        log2_bits = max(10, (len(trigrams) * 8).bit_length())
+        bloom = bytearray(1 << (log2_bits - 3))
+        for t in trigrams:
+            bit = bloom_bit(t, log2_bits)
+            bloom[bit >> 3] |= 1 << (bit & 7)
+        return log2_bits, zlib.compress(bytes(bloom))
+
+    def add(self, oid, data):
+        self.pending.append((oid,) + self.signature(data))
+        if len(self.pending) >= 1000:
+            self.commit()
+
+    def commit(self):
+        self.db.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", self.pending)
+        self.db.commit()
+        self.pending.clear()
+
+    def candidates(self, blobs, query):
+        """返回 (已建索引且可能匹配的 blob, 尚未建索引的 blob)。"""
+        wanted = set(blobs)
+        masks = {}
+        hits = set()
+        for oid, log2_bits, bloom in self.db.execute("SELECT oid, log2_bits, bloom FROM blobs"):
+            if oid not in wanted:
+                continue
+            wanted.discard(oid)
+            if query is None or bloom is None:
+                hits.add(oid)
+                continue
+            if log2_bits not in masks:
+                # 必须按位或：两个 trigram 落到同一位时用加法会进位成别的位，误删真正的匹配
+                masks[log2_bits] = [functools.reduce(operator.or_, (1 << bloom_bit(t, log2_bits) for t in alt), 0)
+                                    for alt in query]
+            bits = int.from_bytes(zlib.decompress(bloom), "little")
+            if any(bits & mask == mask for mask in masks[log2_bits]):
+                hits.add(oid)
+        return [b for b in blobs if b in hits], [b for b in blobs if b in wanted]
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+def default_index_path(repo_dir):
+    git_dir = subprocess.run(
+        ["git", "rev-parse", "--git-common-dir"],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    return Path(repo_dir, git_dir) / "gitgrep-index.sqlite"
+
+def search_blobs(repo_dir, regex, index=None, rev_args=("--all",), paths=()):
+    """每个不同的 blob 只搜索一次，再通过（带缓存的）tree 遍历映射回包含它的提交和路径。
+    给了 index 时先用 trigram 索引排除不可能匹配的 blob，并顺带为新 blob 建索引。
+    逐个产出 (commit, [Match...])，顺序与 git rev-list 一致。"""
+    pattern = compile_regex(regex)
+    if pattern is None:
+        raise SystemExit(f"Error: --blobs needs a Python-compatible regex: {regex}")
+    log = subprocess.run(
+        ["git", "log", "--format=%H %T", *rev_args],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    commits = list(zip(log[::2], log[1::2]))
+    if not commits:
+        print("No commits found. Exiting.")
+        return
+    cat = CatFile(repo_dir)
+    oid_len = len(commits[0][1]) // 2
+    selected = {}
+
+    def walk_selected(tree, prefix=""):
+        # tree -> [(完整路径, blob)]，只展开可能包含选中路径的目录；同一位置的同一个 tree 只展开一次
+        key = (tree, prefix)
+        if key in selected:
+            return selected[key]
+        found = []
+        _, data = cat.read(tree)
+        for mode, name, oid in parse_tree(data, oid_len):
+            path = prefix + name.decode("utf-8", "replace")
+            if mode == b"40000":
+                if may_contain(path, paths):
+                    found.extend(walk_selected(oid, path + "/"))
+            elif mode != b"160000" and path_selected(path, paths):
+                found.append((path, oid))
+        selected[key] = found
+        return found
+
+    if paths:
+        # 有路径限制时先遍历 tree，只搜索落在这些路径下的 blob
+        blobs = list({blob: None for _, tree in commits for _, blob in walk_selected(tree)})
+    else:
+        blobs = get_all_blobs(repo_dir, [commit for commit, _ in commits])
+    print(f"Found {len(blobs)} unique blobs. Starting search...")
+    new = set()
+    if index is not None:
+        candidates, unindexed = index.candidates(blobs, regex_trigrams(regex))
+        new = set(unindexed)
+        print(f"Index: {len(blobs) - len(candidates) - len(new)} blobs pruned, "
+              f"{len(candidates)} candidates, {len(new)} new blobs to index")
+        scan = candidates + unindexed
+    else:
+        scan = blobs
+    matched = {}
+    for oid, kind, data in tqdm(cat.read_many(scan), total=len(scan), desc="Searching blobs", unit="blob"):
+        if data is None:
+            continue
+        if oid in new:
+            index.add(oid, data)
+        lines = search_blob(pattern, data)
+        if lines is None or lines:
+            matched[oid] = lines
+    if index is not None:
+        index.commit()
+    if not matched:
+        cat.close()
+        return
+
+    print(f"{len(matched)} blobs match. Mapping them back to commits...")
+    trees = {}
+
+    def walk(tree):
+        # tree -> [(相对路径, blob)]，只保留匹配的 blob；同一个 tree 只展开一次
+        if tree in trees:
+            return trees[tree]
+        found = []
+        _, data = cat.read(tree)
+        for mode, name, oid in parse_tree(data, oid_len):
+            name = name.decode("utf-8", "replace")
+            if mode == b"40000":
+                found.extend((f"{name}/{path}", blob) for path, blob in walk(oid))
+            elif oid in matched and mode != b"160000":
+                found.append((name, oid))
+        trees[tree] = found
+        return found
+
+    try:
+        for commit, tree in tqdm(commits, desc="Mapping commits", unit="commit"):
+            out = []
+            for path, blob in (walk_selected(tree) if paths else walk(tree)):
+                if blob not in matched:
+                    continue
+                if matched[blob] is None:
+                    out.append(Match(commit, path, None, None, None))
+                else:
+                    out.extend(Match(commit, path, *hit) for hit in matched[blob])
+            if out:
+                yield commit, out
+    finally:
+        cat.close()
+
+def format_match(m):
+    if m.text is None:
+        return f"Binary file {m.commit}:{m.path} matches"
+    return f"{m.commit}:{m.path}:{m.text}"
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python search_commits.py <repo_dir> <regex>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Search every commit of a Git repository for a regex.")
+    parser.add_argument("repo_dir", help="Path to the Git repository")
+    parser.add_argument("regex", help="Extended regular expression (as in git grep -E)")
+    parser.add_argument("paths", nargs="*",
+                        help="Only search these paths (after --; directories, globs, :!exclude). Every selected "
+                             "commit is still searched")
+    parser.add_argument("--rev", action="append", default=[],
+                        help="Revision or range to search instead of --all (repeatable), e.g. main, v1.0..HEAD")
+    parser.add_argument("--since", help="Only commits newer than this date (as in git log --since)")
+    parser.add_argument("--until", help="Only commits older than this date (as in git log --until)")
+    parser.add_argument("--blobs", action="store_true",
+                        help="Search each distinct blob once and map matches back to commits, instead of "
+                             "running git grep per commit (much faster on long histories; uses Python regex syntax)")
+    parser.add_argument("--index", action="store_true",
+                        help="Use (and incrementally update) a persistent trigram index to skip blobs that "
+                             "cannot match; implies --blobs")
+    parser.add_argument("--index-file", help="Index location, default: <git dir>/gitgrep-index.sqlite")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of git grep processes to run in parallel, default: 1")
+    parser.add_argument("--unordered", action="store_true",
+                        help="With --jobs, print commits as soon as they finish instead of in commit order")
+    parser.add_argument("--max-matches", type=int, default=0,
+                        help="Stop after printing this many matching lines (0 = no limit)")
+    parser.add_argument("--json", action="store_true",
+                        help="Print one JSON object per match (commit, path, line_number, text, spans) on stdout; "
+                             "spans are byte offsets within the line, binary files have null line/text")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Print each distinct (path, line) match only for the oldest commit it appears in "
+                             "(commits are then scanned oldest first; with --unordered, whichever finishes first)")
+    args = parser.parse_intermixed_args()  # 允许选项写在 "-- <路径>" 之前
+    out = sys.stdout
+    if args.json:
+        # JSON 模式下 stdout 只留给结果，状态信息改到 stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            run(args, out)
+    else:
+        run(args, out)
+
+def run(args, out):
 
     # 从命令行获取参数
-    repo_dir = sys.argv[1]
-    regex = sys.argv[2]
+    repo_dir = args.repo_dir
+    regex = args.regex
 
     # 检查目录是否存在并且是一个 Git 仓库
     repo_path = Path(repo_dir)
@@ -53,21 +566,58 @@ def main():
 
     print(f"Searching in repository: {repo_dir}")
     print(f"Regex: {regex}")
+    rev_args = rev_list_args(args.rev, args.since, args.until)
+    if args.dedupe:
+        # 从最老的提交往新扫，留下的是引入这一行的提交，而不是最近的一个
+        rev_args.append("--reverse")
 
-    print("Fetching all commits...")
-    commits = get_all_commits(repo_dir)
-    if not commits:
-        print("No commits found. Exiting.")
-        return
+    index = None
+    if args.blobs or args.index:
+        index = BlobIndex(args.index_file or default_index_path(repo_dir)) if args.index else None
+        results = search_blobs(repo_dir, regex, index, rev_args, args.paths)
+    else:
+        print("Fetching all commits...")
+        commits = get_all_commits(repo_dir, rev_args)
+        if not commits:
+            print("No commits found. Exiting.")
+            return
+
+        print(f"Found {len(commits)} commits. Starting search...")
+        results = scan_commits(repo_dir, commits, regex, max(args.jobs, 1), not args.unordered, args.paths)
 
-    print(f"Found {len(commits)} commits. Starting search...")
-    for commit in tqdm(commits, desc="Searching commits", unit="commit"):
-        result = search_in_commit(repo_dir, commit, regex)
-        if result:
-            print(f"\nCommit: {commit}")
-            print(result)
-            print("-" * 40)
+    remaining = args.max_matches or None
+    seen = set()
+    try:
+        for commit, matches in results:
+            printed = False
+            for m in matches:
+                if args.dedupe:
+                    key = (m.path, m.text)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                if args.json:
+                    out.write(json.dumps(m._asdict(), ensure_ascii=False) + "\n")
+                else:
+                    if not printed:
+                        print(f"\nCommit: {commit}")
+                    print(format_match(m))
+                printed = True
+                if remaining is not None:
+                    remaining -= 1
+                    if remaining == 0:
+                        break
+            if hasattr(matches, "close"):
+                matches.close()
+            if printed and not args.json:
+                print("-" * 40)
+            if remaining == 0:
+                print(f"Reached --max-matches {args.max_matches}, stopping.")
+                break
+    finally:
+        results.close()
+        if index is not None:
+            index.close()
 
 if __name__ == "__main__":
     main()
-
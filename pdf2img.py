@@ -1,28 +1,206 @@
 import os
-import sys
+import math
+import mmap
+import multiprocessing
+import argparse
+import functools
+import tempfile
 import fitz  # PyMuPDF
 from PIL import Image, ImageChops
 
+try:
+    import numpy as np  # 可选：有 numpy 时直接在 pixmap 上找 bbox，快很多
+except ImportError:
+    np = None
 
-def get_content_bbox(img):
+
+def get_content_bbox(img, tolerance=0):
     """
     获取图像中“非背景”的最小外接矩形 bbox。
-    背景色取左上角像素。
+    背景色取左上角像素，与背景差值不超过 tolerance 的视为背景（扫描件噪点）。
     返回 (left, upper, right, lower) 或 None
     """
     bg_color = img.getpixel((0, 0))
     bg = Image.new(img.mode, img.size, bg_color)
 
     diff = ImageChops.difference(img, bg)
+    if tolerance:
+        diff = diff.point(lambda v: 255 if v > tolerance else 0)
     bbox = diff.getbbox()
     return bbox
 
 
+def get_pixmap_bbox(pix, tolerance=0, step=1):
+    """
+    与 get_content_bbox 相同，但直接在 pixmap 的像素缓冲区上用 numpy 计算（零拷贝，不生成整页的中间图像）。
+    step > 1 时只看每 step 行/列的像素，是有损的：完全落在两个采样行/列之间的细线、小点会被漏掉。
+    被采到的内容向每个方向各多留一整个 step，保证包住它在相邻采样点之间延伸出去的部分。
+    """
+    n = pix.n
+    a = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    a = a.reshape(pix.height, pix.stride)[:, :pix.width * n].reshape(pix.height, pix.width, n)
+    if step > 1:
+        a = np.ascontiguousarray(a[::step, ::step])  # 只有原图 1/step² 大小
+    h, w = a.shape[:2]
+    bg = a[0, 0].astype(np.int16)
+    hi = np.minimum(bg + tolerance, 255).astype(np.uint8)
+    lo = np.maximum(bg - tolerance, 0).astype(np.uint8)
+
+    # 某行/列有内容 <=> 某个通道的最大值高于背景上限或最小值低于背景下限。
+    # 行：背景各通道相同（白底、灰底）时把整行当一维数组归约，内存连续最快；否则逐通道归约
+    if (hi == hi[0]).all() and (lo == lo[0]).all():
+        flat = a.reshape(h, w * n)
+        rows = (flat.max(axis=1) > hi[0]) | (flat.min(axis=1) < lo[0])
+    else:
+        rows = np.zeros(h, dtype=bool)
+        for c in range(n):
+            rows |= (a[:, :, c].max(axis=1) > hi[c]) | (a[:, :, c].min(axis=1) < lo[c])
+    ys = np.flatnonzero(rows)
+    if ys.size == 0:
+        return None
+    upper, lower = int(ys[0]), int(ys[-1]) + 1
+
+    # 列：只在有内容的行范围内按列归约
+    band = a[upper:lower]
+    cols = ((band.max(axis=0) > hi) | (band.min(axis=0) < lo)).any(axis=1)
+    xs = np.flatnonzero(cols)
+    left, right = int(xs[0]), int(xs[-1]) + 1
+
+    if step > 1:
+        return (
+            max((left - 1) * step, 0),
+            max((upper - 1) * step, 0),
+            min(right * step + 1, pix.width),
+            min(lower * step + 1, pix.height),
+        )
+    return left, upper, right, lower
+
+
+def pixmap_to_image(pix):
+    mode = "RGBA" if pix.alpha else "RGB"
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+
+def render_page(doc, i, mat):
+    """把第 i 页渲染成 PIL Image。"""
+    return pixmap_to_image(doc.load_page(i).get_pixmap(matrix=mat))
+
+
+def scale_bbox(bbox, scale):
+    """把低分辨率下的 bbox 放大到目标分辨率；向外取整并多留一个低分辨率像素，宁可多留不要裁掉内容。"""
+    left, upper, right, lower = bbox
+    pad = math.ceil(scale)
+    return (
+        max(math.floor(left * scale) - pad, 0),
+        max(math.floor(upper * scale) - pad, 0),
+        math.ceil(right * scale) + pad,
+        math.ceil(lower * scale) + pad,
+    )
+
+
+def crop_to_template(img, template_bbox, extra_top_bottom):
+    if template_bbox is None:
+        return img
+    left, upper, right, lower = template_bbox
+
+    # 上下多留一些
+    upper = max(upper - extra_top_bottom, 0)
+    lower = min(lower + extra_top_bottom, img.height)
+
+    # 横向简单 clamp 一下，防止越界
+    left = max(left, 0)
+    right = min(right, img.width)
+
+    crop_box = (left, upper, right, lower)
+    return img.crop(crop_box)
+
+
+_worker_doc = None
+
+
+def init_worker(pdf_path):
+    """进程池初始化：每个工作进程打开一次 PDF（PyMuPDF 文档对象不能跨进程共享），随进程退出释放。"""
+    global _worker_doc
+    _worker_doc = fitz.open(pdf_path)
+
+
+def detect_chunk(task, doc=None):
+    """第一遍：对一段页面找内容区域。返回该段面积最大的 (面积, 页号, bbox) 或 None，以及暂存信息。
+    doc 为 None 时（进程池中）使用本进程打开的文档。"""
+    pages, detect_dpi, spill_path, tolerance, step = task
+    if doc is None:
+        doc = _worker_doc
+    mat = fitz.Matrix(detect_dpi / 72, detect_dpi / 72)  # 72 是 PDF 默认分辨率
+    best = None
+    spilled = {}  # 页号 -> (偏移, mode, size)
+    spill_file = open(spill_path, "wb") if spill_path else None
+    try:
+        for i in pages:
+            pix = doc.load_page(i).get_pixmap(matrix=mat)
+            if spill_file is not None:
+                spilled[i] = (spill_file.tell(), "RGBA" if pix.alpha else "RGB", (pix.width, pix.height))
+                spill_file.write(pix.samples_mv)
+
+            if np is not None:
+                bbox = get_pixmap_bbox(pix, tolerance, step)
+            else:
+                bbox = get_content_bbox(pixmap_to_image(pix), tolerance)
+            if bbox is None:
+                # 这一页可能是全空白，跳过
+                continue
+
+            left, upper, right, lower = bbox
+            area = (right - left) * (lower - upper)
+            if best is None or area > best[0]:
+                best = (area, i, bbox)
+    finally:
+        if spill_file is not None:
+            spill_file.close()
+    return best, spilled
+
+
+def export_chunk(task, doc=None):
+    """第二遍：按模板裁剪并导出一段页面，返回保存的路径（按页序）。"""
+    pages, dpi, template_bbox, extra_top_bottom, output_dir, spill_path, spilled = task
+    mat = fitz.Matrix(dpi / 72, dpi / 72)
+    paths = []
+    spill_file = open(spill_path, "rb") if spill_path else None
+    cache = mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ) if spilled else None
+    try:
+        for i in pages:
+            if cache is not None:
+                offset, mode, size = spilled[i]
+                length = size[0] * size[1] * len(mode)
+                img = Image.frombytes(mode, size, cache[offset:offset + length])
+            else:
+                img = render_page(doc if doc is not None else _worker_doc, i, mat)
+            img = crop_to_template(img, template_bbox, extra_top_bottom)
+
+            # 页码从 1 开始命名
+            img_path = os.path.join(output_dir, f"{i + 1}.png")
+            img.save(img_path)
+            paths.append(img_path)
+    finally:
+        if cache is not None:
+            cache.close()
+        if spill_file is not None:
+            spill_file.close()
+            os.unlink(spill_path)
+    return paths
+
+
 def pdf_to_uniform_cropped_images(
     pdf_path,
     output_dir=None,
     dpi=150,
-    extra_top_bottom=20  # 上下额外多留的像素
+    extra_top_bottom=20,  # 上下额外多留的像素
+    bbox_dpi=None,  # 第一遍用更低的 dpi 渲染来找 bbox，每页只做一次全分辨率渲染
+    spill=False,  # 第一遍的全分辨率渲染结果暂存到临时文件（mmap 读回），每页只渲染一次
+    spill_dir=None,
+    jobs=1,  # >1 时用多个进程并行渲染，按页段分配
+    chunk_pages=4,  # 并行时每个任务处理的页数
+    tolerance=0,  # 与背景色差值不超过它的像素视为背景
+    bbox_step=1,  # 找 bbox 时每隔多少行/列取一个像素（需要 numpy）
 ):
     # 如果没指定输出目录，就在 PDF 同目录下建一个同名文件夹
     if output_dir is None:
@@ -31,89 +209,93 @@ def pdf_to_uniform_cropped_images(
 
     os.makedirs(output_dir, exist_ok=True)
 
+    # 串行时在本进程打开文档并在结束时关闭；并行时由每个工作进程各自打开
     doc = fitz.open(pdf_path)
     page_count = doc.page_count
+    pool = spill_tmp = None
+    try:
+        if jobs > 1:
+            doc.close()
+            doc = None
+            pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(pdf_path,))
+            imap = pool.imap
+        else:
+            imap = lambda fn, tasks: map(functools.partial(fn, doc=doc), tasks)
 
-    # ---------- 第一遍：找到内容区域最大的那一页 ----------
-    max_area = 0
-    template_bbox = None
-
-    print("第一遍：计算每页内容区域，选择最大的那一页作为裁剪模板...")
+        # 串行时每段 1 页，保证逐页输出进度；并行时每个进程一次处理一小段，内存只占一页
+        size = chunk_pages if jobs > 1 else 1
+        chunks = [range(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+        spill_tmp = tempfile.TemporaryDirectory(dir=spill_dir) if spill else None
+        spill_paths = [os.path.join(spill_tmp.name, f"{n}.raw") if spill_tmp else None for n in range(len(chunks))]
 
-    zoom = dpi / 72  # 72 是 PDF 默认分辨率
-    mat = fitz.Matrix(zoom, zoom)
+        # ---------- 第一遍：找到内容区域最大的那一页 ----------
+        print("第一遍：计算每页内容区域，选择最大的那一页作为裁剪模板...")
 
-    for i in range(page_count):
-        page = doc.load_page(i)
-        pix = page.get_pixmap(matrix=mat)
+        detect_dpi = bbox_dpi or dpi
+        detected = list(imap(detect_chunk, [(pages, detect_dpi, path, tolerance, bbox_step)
+                                            for pages, path in zip(chunks, spill_paths)]))
 
-        # 转 PIL Image
-        mode = "RGBA" if pix.alpha else "RGB"
-        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        # 归并：面积最大者胜出，面积相同取页号最小的（与逐页顺序扫描结果一致）
+        found = [best for best, _ in detected if best is not None]
+        max_area, _, template_bbox = max(found, key=lambda b: (b[0], -b[1])) if found else (0, None, None)
 
-        bbox = get_content_bbox(img)
-        if bbox is None:
-            # 这一页可能是全空白，跳过
-            continue
+        if template_bbox is not None and bbox_dpi:
+            template_bbox = scale_bbox(template_bbox, dpi / bbox_dpi)
+            max_area = (template_bbox[2] - template_bbox[0]) * (template_bbox[3] - template_bbox[1])
 
-        left, upper, right, lower = bbox
-        w = right - left
-        h = lower - upper
-        area = w * h
+        if template_bbox is None:
+            print("未能检测到任何内容区域，可能是空白 PDF？将不进行裁剪，直接导出整页。")
+        else:
+            print(f"选中的最大内容页 bbox: {template_bbox}, 面积: {max_area}")
 
-        if area > max_area:
-            max_area = area
-            template_bbox = bbox
+        # ---------- 第二遍：按选中的 bbox 统一裁剪并导出 ----------
+        print("第二遍：按统一裁剪框导出所有页面图片...")
 
-    if template_bbox is None:
-        print("未能检测到任何内容区域，可能是空白 PDF？将不进行裁剪，直接导出整页。")
-    else:
-        print(f"选中的最大内容页 bbox: {template_bbox}, 面积: {max_area}")
-
-    # ---------- 第二遍：按选中的 bbox 统一裁剪并导出 ----------
-    print("第二遍：按统一裁剪框导出所有页面图片...")
-
-    for i in range(page_count):
-        page = doc.load_page(i)
-        pix = page.get_pixmap(matrix=mat)
-
-        mode = "RGBA" if pix.alpha else "RGB"
-        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
-
-        if template_bbox is not None:
-            left, upper, right, lower = template_bbox
+        tasks = [(pages, dpi, template_bbox, extra_top_bottom, output_dir, path, spilled)
+                 for pages, path, (_, spilled) in zip(chunks, spill_paths, detected)]
+        for paths in imap(export_chunk, tasks):
+            for img_path in paths:
+                print(f"已保存: {img_path}")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if spill_tmp is not None:
+            spill_tmp.cleanup()
+        if doc is not None:
+            doc.close()
 
-            # 上下多留一些
-            upper = max(upper - extra_top_bottom, 0)
-            lower = min(lower + extra_top_bottom, img.height)
-
-            # 横向简单 clamp 一下，防止越界
-            left = max(left, 0)
-            right = min(right, img.width)
-
-            crop_box = (left, upper, right, lower)
-            img = img.crop(crop_box)
-
-        # 页码从 1 开始命名
-        page_num = i + 1
-        img_path = os.path.join(output_dir, f"{page_num}.png")
-        img.save(img_path)
-        print(f"已保存: {img_path}")
-
-    doc.close()
     print(f"完成！共导出 {page_count} 页到文件夹：{output_dir}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("用法: python pdf2img_uniform_crop.py your.pdf [输出文件夹] [dpi] [extra_top_bottom]")
-        print("示例: python pdf2img_uniform_crop.py test.pdf out_pages 200 40")
-        sys.exit(1)
-
-    pdf_path = sys.argv[1]
-    output_dir = sys.argv[2] if len(sys.argv) >= 3 else None
-    dpi = int(sys.argv[3]) if len(sys.argv) >= 4 else 150
-    extra_top_bottom = int(sys.argv[4]) if len(sys.argv) >= 5 else 20
+    parser = argparse.ArgumentParser(
+        description="把 PDF 每页导出为 PNG，并按内容最多的一页统一裁剪",
+        epilog="示例: python pdf2img.py test.pdf out_pages 200 40 --bbox-dpi 50",
+    )
+    parser.add_argument("pdf_path", help="输入 PDF")
+    parser.add_argument("output_dir", nargs="?", default=None, help="输出文件夹，默认在 PDF 旁边建 <名字>_pages")
+    parser.add_argument("dpi", nargs="?", type=int, default=150, help="导出分辨率，默认 150")
+    parser.add_argument("extra_top_bottom", nargs="?", type=int, default=20, help="上下额外多留的像素，默认 20")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--bbox-dpi", type=int, default=None,
+                      help="用这个较低的 dpi 渲染来找裁剪框（例如 50），全分辨率只渲染一次；裁剪框会略微放宽")
+    mode.add_argument("--spill", action="store_true",
+                      help="每页只渲染一次：第一遍的渲染结果暂存到临时文件（需要约 页数×单页原始大小 的磁盘空间）")
+    parser.add_argument("--spill-dir", default=None, help="--spill 临时文件所在目录，默认系统临时目录")
+    parser.add_argument("--tolerance", type=int, default=0,
+                        help="与背景色（左上角像素）的差值不超过它的像素视为背景，用于扫描件的噪点，默认 0")
+    parser.add_argument("--bbox-step", type=int, default=1,
+                        help="找裁剪框时每隔多少行/列采样一个像素（需要 numpy）。有损：更快，但完全落在采样点之间的"
+                             "细线、小点会被裁掉，默认 1（逐像素，不丢内容）")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="并行渲染的进程数，默认 1")
+    parser.add_argument("--chunk-pages", type=int, default=4, help="并行时每个任务分到的连续页数，默认 4")
+    args = parser.parse_args()
 
-    pdf_to_uniform_cropped_images(pdf_path, output_dir, dpi, extra_top_bottom)
+    if args.bbox_dpi is not None and not 0 < args.bbox_dpi < args.dpi:
+        parser.error("--bbox-dpi 需要大于 0 且小于 dpi")
 
+    pdf_to_uniform_cropped_images(args.pdf_path, args.output_dir, args.dpi, args.extra_top_bottom,
+                                  bbox_dpi=args.bbox_dpi, spill=args.spill, spill_dir=args.spill_dir,
+                                  jobs=max(args.jobs, 1), chunk_pages=max(args.chunk_pages, 1),
+                                  tolerance=args.tolerance, bbox_step=max(args.bbox_step, 1))
@@ -0,0 +1,37 @@
+import gitgrep
+
+
+def test_search_blob_empty_matching_patterns_terminate():
+    data = b"foo\nbar\n\nbaz"
+    for regex in ("x*", "^", "$", "(foo)?"):
+        lines = gitgrep.search_blob(gitgrep.compile_regex(regex), data)
+        assert [n for n, _, _ in lines] == [1, 2, 3, 4], regex
+
+
+def test_search_blob_trailing_newline_is_not_a_line():
+    lines = gitgrep.search_blob(gitgrep.compile_regex("x*"), b"a\nb\n")
+    assert [text for _, text, _ in lines] == ["a", "b"]
+    assert gitgrep.search_blob(gitgrep.compile_regex("x*"), b"") == []
+
+
+def test_index_candidates_with_colliding_trigrams(tmp_path):
+    data = b"ccaoayyihidz"
+    query = gitgrep.regex_trigrams("ccaoayyihidz")
+    index = gitgrep.BlobIndex(tmp_path / "index.sqlite")
+    log2_bits = index.signature(data)[0]
+    trigrams = {data[i:i + 3] for i in range(len(data) - 2)}
+    # 这个字面量里有落到同一位的 trigram，正是加法构造掩码时出错的情况
+    assert len({gitgrep.bloom_bit(t, log2_bits) for t in trigrams}) < len(trigrams)
+    index.add("blob", data)
+    index.commit()
+    assert index.candidates(["blob"], query) == (["blob"], [])
+    index.close()
+
+
+def test_may_contain_prunes_unrelated_directories():
+    assert gitgrep.may_contain("config", ["config/a.txt"])
+    assert gitgrep.may_contain("config/sub", ["config"])
+    assert not gitgrep.may_contain("src", ["config/a.txt"])
+    assert not gitgrep.may_contain("conf", ["config/a.txt"])
+    assert gitgrep.may_contain("src", ["*.txt"])
+    assert gitgrep.may_contain("src", [":!config"])